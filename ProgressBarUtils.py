@@ -1,15 +1,33 @@
+import atexit
+import json
+import os
+import sys
 import time
+from collections import deque
+from threading import Thread, Event, Lock
 
+from settings import PROGRESS_INTERVAL, PROGRESS_QUIET_INTERVAL
 from utils import size_format
 
 
+def time_format(seconds):
+    """剩余时间格式化为 时:分:秒"""
+    if seconds is None:
+        return '--:--'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
 class DownloaderProgressBar:
-    def __init__(self, filename: str, total: int, width: int = 30):
+    def __init__(self, filename: str, total: int, width: int = 30, renderer=None):
         """
         下载器进度条
+        下载线程只记录进度增量,由渲染线程统一计算速度并输出
         @param filename: 文件名
         @param total: 文件大小
         @param width: 进度条长度
+        @param renderer: 进度渲染器,默认使用全局的 progress_renderer
         """
         self.entity_symbol = '■'
         self.empty_symbol = '□'
@@ -18,80 +36,270 @@ class DownloaderProgressBar:
         self.total_format = size_format(self.total)
         self.width = width
         self.filename = filename
+        # 以下由渲染线程更新
         self.progress = 0
-        self.speed = 0
+        self.speed = None
         self.timer = time.time()
-        self.update_time = self.timer
+        # 以下由下载线程更新
+        self.increments = deque()
+        self.target = None
         self.finished = False
+        self.closed = False
+        self.reported = False
+        self.lock = Lock()
+
+        self.renderer = renderer or progress_renderer
+        self.renderer.message(f"Downloading {self.filename} ({self.total_format})")
+        self.renderer.add(self)
 
-        print(f"Downloading {self.filename} ({self.total_format})")
+    def __enter__(self):
+        return self
 
-    def print_bar(self):
-        """打印进度条"""
-        left = int(self.width * self.progress // self.total)
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def format(self):
+        """进度条文本"""
+        left = int(self.width * min(self.progress, self.total) // self.total) if self.total else self.width
         right = self.width - left
-        percent = self.progress / self.total * 100
-        print(
-            f'\r{percent:>2.0f}%',
+        percent = self.progress / self.total * 100 if self.total else 100
+        return ' '.join((
+            f'{percent:>3.0f}%',
             f"[{self.entity_symbol * left}{self.empty_symbol * right}]",
-            f"[{size_format(self.progress)}/{self.total_format}, {size_format(self.speed)}/s]",
-            end='',
-            flush=True,
-        )
+            f"[{size_format(self.progress)}/{self.total_format}, {size_format(int(self.speed or 0))}/s,",
+            f"ETA {time_format(self.eta)}]",
+            self.filename,
+        ))
+
+    @property
+    def eta(self):
+        """预计剩余时间(秒),还没有速度时为 None"""
+        if not self.speed:
+            return None
+        return max(0, self.total - self.progress) / self.speed
+
+    def collect(self, interval, alpha):
+        """
+        渲染线程调用,汇总下载线程记录的进度并更新速度
+        @param interval: 距离上次汇总的时间(秒)
+        @param alpha: 速度指数加权平均中新样本的权重
+        @return: 这段时间增加的进度
+        """
+        progress = self.progress
+        target = self.target
+        if target is not None:
+            self.target = None
+            progress = target
+        while self.increments:
+            progress += self.increments.popleft()
+        incremental = progress - self.progress
+        self.progress = progress
+        if interval > 0:
+            speed = incremental / interval
+            self.speed = speed if self.speed is None else alpha * speed + (1 - alpha) * self.speed
+        if self.progress >= self.total:
+            self.finished = True
+        return incremental
 
     def finish(self):
-        """打印下载完成信息"""
+        """标记下载完成并输出下载完成信息"""
         self.finished = True
-        time_cost = time.time() - self.timer
-        info = f"(time cost:{time_cost:.1f}s,average speed:{size_format(int(self.total / time_cost))}/s)"
-        print(f"\nDownloaded  {self.filename} {info}")
+        self.report()
+
+    def report(self):
+        """
+        输出下载完成信息,只输出一次
+        通过 finish 在下载线程中加入信息队列时,与该线程之后输出的信息保持顺序;
+        完成信息在渲染线程汇总进度后才生成
+        """
+        with self.lock:
+            if self.reported:
+                return
+            self.reported = True
+        self.renderer.message(self)
+
+    def close(self):
+        """不再显示进度条,未完成时不打印下载完成信息"""
+        self.closed = True
+
+    def finish_info(self):
+        """下载完成信息"""
+        time_cost = max(time.time() - self.timer, 1e-3)
+        info = f"(time cost:{time_cost:.1f}s,average speed:{size_format(int(self.progress / time_cost))}/s)"
+        return f"Downloaded  {self.filename} {info}"
 
     def update(self, progress, interval=None):
         """
         更新进度
         @param progress: 新进度
-        @param interval: 距离上次更新的时间间隔(用于计算下载速度),默认使用 time() 函数获取
+        @param interval: 保留参数,下载速度由渲染线程计算
         @return:
         """
-        if self.finished:
-            return
-        if interval is None:
-            update_time = time.time()
-            interval = update_time - self.update_time
-        else:
-            update_time = self.update_time + interval
-
-        incremental = progress - self.progress
-        self.speed = int(incremental / interval)
-        self.progress = min(progress, self.total)
-        self.update_time = update_time
-
-        self.print_bar()
-        if progress >= self.total:
-            self.finish()
+        self.target = progress
 
     def addition(self, incremental, interval=None):
         """
         增量进度
+        deque.append 是原子操作,多个线程同时调用也不需要加锁
         @param incremental: 增加的进度(是一个增加量,不是新进度)
-        @param interval: 距离上次更新的时间间隔(用于计算下载速度),默认使用 time() 函数获取
+        @param interval: 保留参数,下载速度由渲染线程计算
         @return:
         """
-        progress = self.progress + incremental
-        self.update(progress, interval)
+        self.increments.append(incremental)
+
+
+class ProgressRenderer:
+    """
+    进度渲染器
+    由一个后台线程每隔 interval 毫秒汇总所有进度条并输出:
+    终端中显示总进度及每个视频的进度条;输出不是终端时每隔 quiet_interval 秒输出一行 json
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL, quiet_interval=PROGRESS_QUIET_INTERVAL, stream=None, alpha=0.3):
+        """
+        @param interval: 刷新间隔(毫秒)
+        @param quiet_interval: 非终端模式的输出间隔(秒)
+        @param stream: 输出流,默认为 sys.stdout
+        @param alpha: 速度指数加权平均中新样本的权重
+        """
+        self.interval = interval / 1000
+        self.quiet_interval = quiet_interval
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty()
+        self.alpha = alpha
+        # 其他线程只向队列追加,由渲染线程取出
+        self.new_bars = deque()
+        self.messages = deque()
+        self.bars = []
+        self.speed = None
+        self.drawn = 0
+        self.render_time = time.monotonic()
+        self.quiet_time = 0
+        self.thread = None
+        self.stop_event = Event()
+        self.lock = Lock()
+
+    def start(self):
+        """启动渲染线程"""
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            if self.tty and os.name == 'nt':
+                # 开启 Windows 终端的 ANSI 转义序列支持
+                os.system('')
+            self.thread = Thread(target=self.run, name='progress', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """停止渲染线程,输出剩余的信息"""
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.stop_event.clear()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.render()
+        self.render()
+
+    def add(self, bar):
+        self.new_bars.append(bar)
+        self.start()
+
+    def message(self, text):
+        """
+        在进度条上方输出一行信息
+        @param text: 信息,或者已完成的进度条(输出它的完成信息)
+        """
+        self.messages.append(text)
+        self.start()
+
+    def render(self):
+        """汇总进度并输出一次"""
+        now = time.monotonic()
+        interval = now - self.render_time
+        self.render_time = now
+        while self.new_bars:
+            self.bars.append(self.new_bars.popleft())
+
+        incremental = sum(bar.collect(interval, self.alpha) for bar in self.bars)
+        if self.bars and interval > 0:
+            speed = incremental / interval
+            self.speed = speed if self.speed is None else self.alpha * speed + (1 - self.alpha) * self.speed
+
+        for bar in self.bars:
+            if bar.finished:
+                bar.report()
+        self.bars = [bar for bar in self.bars if not (bar.finished or bar.closed)]
+        lines = []
+        while self.messages:
+            message = self.messages.popleft()
+            lines.append(message.finish_info() if isinstance(message, DownloaderProgressBar) else message)
+
+        if self.tty:
+            self.draw(lines)
+        else:
+            self.write_quiet(lines, now)
+
+    def draw(self, lines):
+        """终端模式:覆盖上次输出的进度条"""
+        live = [bar.format() for bar in self.bars]
+        if len(self.bars) > 1:
+            live.insert(0, self.format_total())
+        if not lines and not live and not self.drawn:
+            return
+        output = [f"\x1b[{self.drawn}F"] if self.drawn else []
+        output.extend(f"{line}\x1b[K\n" for line in lines + live)
+        output.append("\x1b[J")
+        self.drawn = len(live)
+        self.stream.write(''.join(output))
+        self.stream.flush()
+
+    def format_total(self):
+        """总进度文本"""
+        progress = sum(bar.progress for bar in self.bars)
+        total = sum(bar.total for bar in self.bars)
+        eta = max(0, total - progress) / self.speed if self.speed else None
+        return (f"Total {len(self.bars)} files [{size_format(progress)}/{size_format(total)}, "
+                f"{size_format(int(self.speed or 0))}/s, ETA {time_format(eta)}]")
+
+    def write_quiet(self, lines, now):
+        """非终端模式:信息原样输出,进度每隔 quiet_interval 秒输出一行 json"""
+        output = [f"{line}\n" for line in lines]
+        if self.bars and now - self.quiet_time >= self.quiet_interval:
+            self.quiet_time = now
+            for bar in self.bars:
+                output.append(json.dumps({
+                    'file': bar.filename,
+                    'progress': bar.progress,
+                    'total': bar.total,
+                    'speed': int(bar.speed or 0),
+                    'eta': None if bar.eta is None else round(bar.eta),
+                }, ensure_ascii=False) + '\n')
+        if output:
+            self.stream.write(''.join(output))
+            self.stream.flush()
+
+
+progress_renderer = ProgressRenderer()
 
 
 def main():
     import random
 
     size = 1024 * 1024
-    bar = DownloaderProgressBar("测试文件.txt", size)
+    bars = [DownloaderProgressBar(f"测试文件{i}.txt", size) for i in range(3)]
     incremental = 1024 * 10
-    while not bar.finished:
+    while not all(bar.finished for bar in bars):
         time.sleep(0.2)
-        bar.addition(random.randint(incremental, incremental * 5))
-
-    bar.addition(random.randint(incremental, incremental * 5))
+        for bar in bars:
+            bar.addition(random.randint(incremental, incremental * 5))
+    progress_renderer.stop()
 
 
 if __name__ == '__main__':
@@ -1,20 +1,35 @@
 import base64
 import json
 import re
+import threading
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse, urljoin
 
-import requests
-
 import urls
-from ProgressBarUtils import DownloaderProgressBar
-from cookies import cookiejar, cookies
+from ProgressBarUtils import DownloaderProgressBar, progress_renderer
+from cache import cache, rec_video_info_expire
+from checkpoint import Checkpoint, playlist_fingerprint
+from client import client
+from cookies import cookies
+from keystore import key_store
 from logger import logger
-from m3u8Utils import parse_m3u8, download_ts_split, merge_ts_ffmpeg, download_m3u8
-from settings import DEFAULT_HEADERS, PROXIES, CURRENT_USER, CACHE_PATH
+from m3u8Utils import (
+    parse_m3u8_segments,
+    download_ts_split,
+    download_ts_file,
+    download_ts_ffmpeg,
+    download_ts_assemble,
+    merge_ts_ffmpeg,
+    download_m3u8
+)
+from settings import CURRENT_USER, DOWNLOAD_WORKERS, DOWNLOAD_MODE
 from utils import parse_page
 
+# 避免多个线程同时获取用户信息
+current_user_lock = threading.Lock()
+
 
+@cache.cached('course')
 def get_course_by_cid(cid):
     """
     获取课程信息
@@ -22,18 +37,15 @@ def get_course_by_cid(cid):
     @return: 课程信息
     """
     url = urls.BasicInfoUri.format(cid=cid)
-    response = requests.get(url, headers=DEFAULT_HEADERS, proxies=PROXIES)
-
-    response_json = response.json()
-    with CACHE_PATH.joinpath(f"{cid}.json").open('w') as f:
-        json.dump(response_json, f, ensure_ascii=False, indent=4)
-
-    return response_json
+    response = client.get(url)
+    return response.json()
 
 
-def get_all_courses():
+@cache.cached('courses')
+def get_all_courses(uin):
     """
     获取用户所有的课程
+    @param uin: 当前用户的 uin,作为缓存键,切换账号后不会读到其他账号的课程
     @return: 课程信息列表
     """
 
@@ -55,11 +67,7 @@ def get_all_courses():
     page = 1
     while True:
         # count 参数最多为 10
-        response = requests.get(urls.CourseList,
-                                params={'page': page, 'count': '10'},
-                                headers=DEFAULT_HEADERS,
-                                cookies=cookiejar,
-                                proxies=PROXIES)
+        response = client.get(urls.CourseList, params={'page': page, 'count': '10'})
         result = response.json().get('result')
         add_courses_form_response(result)
         # result 不存在或 response.end != 0 代表有没有下一页
@@ -74,7 +82,7 @@ def choose_course():
     从账号下的所有课程中选择要下载的课程
     @return: 选择的课程ID
     """
-    courses = get_all_courses()
+    courses = get_all_courses(get_current_user()['uin'])
     print('你的账号里有如下课程：')
     for i, course in enumerate(courses):
         print(f"{i + 1}. {course.get('name')}")
@@ -106,7 +114,7 @@ def get_terms_from_api(cid, term_id_list):
     @return:
     """
     params = {'cid': cid, 'term_id_list': term_id_list}
-    response = requests.get(urls.ItemsUri, params=params, headers=DEFAULT_HEADERS, proxies=PROXIES)
+    response = client.get(urls.ItemsUri, params=params)
     return response.json()
 
 
@@ -176,51 +184,80 @@ def get_courses_from_chapter(chapter):
     return chapter.get('task_info')
 
 
+def get_current_user():
+    """
+    获取当前用户信息
+    uin 及登录凭证每次运行只获取一次,保存在 CURRENT_USER 中
+    @return: CURRENT_USER
+    """
+    with current_user_lock:
+        if not CURRENT_USER:
+            set_current_user(get_uin())
+    return CURRENT_USER
+
+
+def set_current_user(uin):
+    """
+    根据 uin 从 cookies 中读取登录凭证,保存到 CURRENT_USER 中
+    @param uin: QQ号 / 微信uin
+    """
+    CURRENT_USER['uin'] = uin
+    if len(uin) > 10:
+        # 微信
+        CURRENT_USER['ext'] = cookies.get('uid_a2')
+        CURRENT_USER['appid'] = cookies.get('uid_appid')
+        CURRENT_USER['uid_type'] = cookies.get('uid_type')
+    else:
+        # skey = pskey = plskey = None
+        CURRENT_USER['plskey'] = cookies.get('p_lskey')
+        CURRENT_USER['skey'] = cookies.get('skey')
+        CURRENT_USER['pskey'] = cookies.get('p_skey')
+    CURRENT_USER['tokens'] = {}
+    logger.info('获取用户信息成功')
+
+
 def get_key_url_token(cid, term_id):
     """
     获取 key_url 所需的 token
       这个 key_url 后面要接一个 token,研究发现，token 是如下结构 base64 加密后得到的
       其中的 plskey 是要填的，这个东西来自登陆时的 token 去掉结尾的两个 '='，也可以在 cookies.json 里获取
+      token 中包含 cid 和 term_id,按 (cid, term_id) 分别缓存
     @param cid: 课程ID
     @param term_id: 学期ID
     @return: key_url_token
     """
-    if not CURRENT_USER:
-        uin = get_uin()
-        CURRENT_USER['uin'] = uin
-        if len(uin) > 10:
-            # 微信
-            CURRENT_USER['ext'] = cookies.get('uid_a2')
-            CURRENT_USER['appid'] = cookies.get('uid_appid')
-            CURRENT_USER['uid_type'] = cookies.get('uid_type')
-            str_token = 'uin={uin};skey=;pskey=;plskey=;ext={uid_a2};uid_appid={appid};' \
-                        'uid_type={uid_type};uid_origin_uid_type=2;uid_origin_auth_type=2;' \
-                        'cid={cid};term_id={term_id};vod_type=0;platform=3' \
-                .format(uin=uin,
-                        uid_a2=CURRENT_USER.get('ext'),
-                        appid=CURRENT_USER.get('appid'),
-                        uid_type=CURRENT_USER.get('uid_type'),
-                        cid=cid,
-                        term_id=term_id)
-        else:
-            # skey = pskey = plskey = None
-            CURRENT_USER['plskey'] = cookies.get('p_lskey')
-            CURRENT_USER['skey'] = cookies.get('skey')
-            CURRENT_USER['pskey'] = cookies.get('p_skey')
-            str_token = 'uin={uin};skey={skey};pskey={pskey};plskey={plskey};ext=;uid_type=0;' \
-                        'uid_origin_uid_type=0;uid_origin_auth_type=0;cid={cid};term_id={term_id};' \
-                        'vod_type=0' \
-                .format(uin=uin,
-                        skey=CURRENT_USER.get('skey'),
-                        pskey=CURRENT_USER.get('pskey'),
-                        plskey=CURRENT_USER.get('plskey'),
-                        cid=cid,
-                        term_id=term_id)
-        CURRENT_USER['token'] = str_token
-
-    # 直接从 CURRENT_USER 里读取参数
-    logger.info(CURRENT_USER)
-    return base64.b64encode(CURRENT_USER.get('token').encode()).decode()[:-2]
+    user = get_current_user()
+    tokens = user.get('tokens')
+    token = tokens.get((cid, term_id))
+    if token:
+        return token
+
+    uin = user.get('uin')
+    if len(uin) > 10:
+        # 微信
+        str_token = 'uin={uin};skey=;pskey=;plskey=;ext={uid_a2};uid_appid={appid};' \
+                    'uid_type={uid_type};uid_origin_uid_type=2;uid_origin_auth_type=2;' \
+                    'cid={cid};term_id={term_id};vod_type=0;platform=3' \
+            .format(uin=uin,
+                    uid_a2=user.get('ext'),
+                    appid=user.get('appid'),
+                    uid_type=user.get('uid_type'),
+                    cid=cid,
+                    term_id=term_id)
+    else:
+        str_token = 'uin={uin};skey={skey};pskey={pskey};plskey={plskey};ext=;uid_type=0;' \
+                    'uid_origin_uid_type=0;uid_origin_auth_type=0;cid={cid};term_id={term_id};' \
+                    'vod_type=0' \
+            .format(uin=uin,
+                    skey=user.get('skey'),
+                    pskey=user.get('pskey'),
+                    plskey=user.get('plskey'),
+                    cid=cid,
+                    term_id=term_id)
+
+    token = base64.b64encode(str_token.encode()).decode()[:-2]
+    tokens[(cid, term_id)] = token
+    return token
 
 
 def get_key_url_from_m3u8(m3u8_url):
@@ -229,7 +266,7 @@ def get_key_url_from_m3u8(m3u8_url):
     @param m3u8_url: 带有 sign,t,us 参数的 m3u8 下载链接
     @return: 秘钥链接
     """
-    m3u8_text = requests.get(m3u8_url, proxies=PROXIES).text
+    m3u8_text = client.get(m3u8_url).text
     pattern = re.compile(r'(https://ke.qq.com/cgi-bin/qcloud/get_dk.+)"')
     return pattern.findall(m3u8_text)[0]
 
@@ -309,6 +346,7 @@ def get_download_urls(cid, term_id, file_id, video_index=0):
     return ts_url, key_url
 
 
+@cache.cached('rec_video_info', expire=rec_video_info_expire)
 def get_rec_video_info(cid, term_id, file_id):
     """
     获取视频信息
@@ -321,7 +359,7 @@ def get_rec_video_info(cid, term_id, file_id):
     header = {
         "srv_appid": 201,
         "cli_appid": "ke",
-        "uin": get_uin(),
+        "uin": get_current_user().get('uin'),
         "cli_info": {"cli_platform": 3}
     }
     params = {
@@ -330,11 +368,7 @@ def get_rec_video_info(cid, term_id, file_id):
         "file_id": file_id,
         "header": json.dumps(header)
     }
-    response = requests.get(urls.VideoRec,
-                            params=params,
-                            cookies=cookiejar,
-                            headers=DEFAULT_HEADERS,
-                            proxies=PROXIES)
+    response = client.get(urls.VideoRec, params=params)
     return response.json().get('result').get('rec_video_info')
 
 
@@ -364,40 +398,122 @@ def get_m3u8_url(cid, term_id, file_id, video_index=0):
     return m3u8_url
 
 
-def download_course(url, cid, term_id, output_path: Path):
+def resolve_course(url, cid, term_id):
     """
-    通过 m3u8 链接下载课程(下载 ts 碎片文件再合成)
+    解析下载课程所需的秘钥及 ts 文件列表
     @param url: m3u8 链接
     @param cid: 课程ID
     @param term_id: 学期ID
-    @param output_path: 保存文件路径
-    @return:
+    @return: key,ts_urls,ivs
     """
     # 解析 m3u8 文件
-    key_url, ts_urls = parse_m3u8(url)
+    key_url, ts_urls, ivs = parse_m3u8_segments(url)
 
     # 拼接带有用户认证的 key_url
     key_url = f"{key_url}&token={get_key_url_token(cid, term_id)}"
 
     # 获取 key
-    key = requests.get(key_url).content
+    key = key_store.get(key_url)
     # print(f"key_url={key_url}")
     # print(ts_urls)
+    return key, ts_urls, ivs
+
 
-    # 下载 ts 文件
-    output_dir = output_path.parent
-    print(f"即将开始开始下载 {output_path}")
+def download_course(url, cid, term_id, output_path: Path, mode=DOWNLOAD_MODE, resolved=None):
+    """
+    通过 m3u8 链接下载课程
+    @param url: m3u8 链接
+    @param cid: 课程ID
+    @param term_id: 学期ID
+    @param output_path: 保存文件路径
+    @param mode: 下载方式
+      split: 下载 ts 碎片文件再合成,支持断点续传
+      stream: 按顺序直接写入一个 ts 文件,支持断点续传,保存为 .ts 文件
+      pipe: 按顺序直接交给 ffmpeg 合成,不产生临时文件
+      assemble: 乱序下载并直接写入一个 ts 文件中各自的位置,支持断点续传,保存为 .ts 文件
+    @param resolved: 已经解析好的 (key, ts_urls, ivs),为空时通过 resolve_course 解析
+    @return:
+    """
+    download = COURSE_DOWNLOADERS.get(mode)
+    if download is None:
+        raise ValueError(f"不支持的下载方式: {mode}")
+    key, ts_urls, ivs = resolved or resolve_course(url, cid, term_id)
+
+    # 多个视频同时下载时,信息由渲染线程输出在进度条上方,避免打乱进度条
+    progress_renderer.message(f"即将开始开始下载 {output_path}")
     # 获取文件大小
     size = int(parse_qs(urlparse(ts_urls[-1]).query).get("end")[0])
-    progress_bar = DownloaderProgressBar(output_path.name, size)
-    ts_files = download_ts_split(ts_urls, key, output_dir, progress_bar)
+    # 大小是估算的,下载结束时手动标记完成;出错时关闭进度条
+    with DownloaderProgressBar(output_path.name, size) as progress_bar:
+        download(ts_urls, key, output_path, progress_bar, ivs)
+        progress_bar.finish()
+    progress_renderer.message('-' * 40)
+
+
+def download_split(ts_urls, key, output_path: Path, progress_bar, ivs=None):
+    """
+    下载 ts 碎片文件再合成,支持断点续传
+    @param ts_urls: ts 文件列表
+    @param key: 秘钥
+    @param output_path: 保存文件路径
+    @param progress_bar: 下载进度条
+    @param ivs: 每个 ts 文件的初始向量
+    """
+    # 每个视频的 ts 文件及断点记录保存在单独的目录中
+    output_dir = output_path.with_name(f"{output_path.stem}.parts")
+    output_dir.mkdir(exist_ok=True)
+    checkpoint = Checkpoint(output_dir.joinpath("checkpoint.json"), key, playlist_fingerprint(ts_urls))
+    ts_files = download_ts_split(ts_urls, key, output_dir, progress_bar,
+                                 workers=DOWNLOAD_WORKERS, checkpoint=checkpoint, ivs=ivs)
+    # 合并期间不再显示进度条
+    progress_bar.finish()
+    progress_bar.close()
 
     # 合并 ts 文件
-    print(f"开始合并 {output_path.name}")
+    progress_renderer.message(f"开始合并 {output_path.name}")
     merge_ts_ffmpeg(ts_files, output_path)  # 不知道为什么,使用这个方法合成的视频时长会多一些
     # merge_ts_copy(output_dir, output_path)  # 合成的视频会时间顺序错乱
-    print(f"合并完成 {output_path.name}")
-    print('-' * 40)
+    checkpoint.remove()
+    output_dir.rmdir()
+    progress_renderer.message(f"合并完成 {output_path.name}")
+
+
+def download_stream(ts_urls, key, output_path: Path, progress_bar, ivs=None):
+    """按顺序直接写入一个 ts 文件,支持断点续传,参数见 download_split"""
+    download_ts_file(ts_urls, key, get_output_path(output_path, 'stream'), progress_bar,
+                     workers=DOWNLOAD_WORKERS, ivs=ivs)
+
+
+def download_assemble(ts_urls, key, output_path: Path, progress_bar, ivs=None):
+    """乱序下载并直接写入一个 ts 文件中各自的位置,支持断点续传,参数见 download_split"""
+    download_ts_assemble(ts_urls, key, get_output_path(output_path, 'assemble'), progress_bar,
+                         workers=DOWNLOAD_WORKERS, ivs=ivs)
+
+
+def download_pipe(ts_urls, key, output_path: Path, progress_bar, ivs=None):
+    """按顺序直接交给 ffmpeg 合成,不产生临时文件,参数见 download_split"""
+    download_ts_ffmpeg(ts_urls, key, output_path, progress_bar, workers=DOWNLOAD_WORKERS, ivs=ivs)
+
+
+# 下载方式对应的下载函数
+COURSE_DOWNLOADERS = {
+    'split': download_split,
+    'stream': download_stream,
+    'assemble': download_assemble,
+    'pipe': download_pipe,
+}
+
+
+def get_output_path(output_path: Path, mode=DOWNLOAD_MODE):
+    """
+    获取下载方式实际保存的文件路径
+    @param output_path: 保存文件路径(.mp4)
+    @param mode: 下载方式
+    @return: 实际保存的文件路径
+    """
+    if mode in ('stream', 'assemble'):
+        return output_path.with_suffix('.ts')
+    return output_path
 
 
 def download_course_m3u8(url, cid, term_id, output_path: Path):
@@ -409,8 +525,6 @@ def download_course_m3u8(url, cid, term_id, output_path: Path):
     @param output_path: 保存文件路径
     @return:
     """
-    headers = "'referer': 'https://ke.qq.com/webcourse/'"
-
     def handle_key_url(key_url):
         return f"{key_url}&token={get_key_url_token(cid, term_id)}"
 
@@ -418,15 +532,12 @@ def download_course_m3u8(url, cid, term_id, output_path: Path):
         return urljoin(url, ts_url)
 
     print(f"开始解析下载 {output_path.name}")
-    download_m3u8(url, output_path, handle_key_url=handle_key_url, handle_ts_url=handle_ts_url, headers=headers)
+    download_m3u8(url, output_path, handle_key_url=handle_key_url, handle_ts_url=handle_ts_url)
     print(f"视频  {output_path.name} 下载完成")
 
 
 def get_uin():
-    response = requests.get(urls.DefaultAccount,
-                            cookies=cookiejar,
-                            headers=DEFAULT_HEADERS,
-                            proxies=PROXIES)
+    response = client.get(urls.DefaultAccount)
     response_json = response.json()
     if response_json.get('retcode') == 0:
         return response_json.get('result').get('tiny_id')
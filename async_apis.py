@@ -0,0 +1,194 @@
+import asyncio
+import json
+import re
+
+import urls
+from apis import get_key_url_token as build_key_url_token, set_current_user
+from cache import cache, rec_video_info_expire
+from client import create_async_client
+from governor import governor
+from settings import CURRENT_USER
+
+# apis 的异步版本,返回值与 apis 中的同名函数一致
+# 每个事件循环一个客户端
+async_clients = {}
+# 避免多个协程同时获取用户信息
+current_user_locks = {}
+
+
+def get_client():
+    """
+    获取当前事件循环共享的异步客户端
+    @return: httpx.AsyncClient
+    """
+    loop = asyncio.get_running_loop()
+    client = async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = async_clients[loop] = create_async_client()
+    return client
+
+
+async def get(url, **kwargs):
+    """
+    使用共享的异步客户端发起 GET 请求,受 host 连接数及请求数限制
+    @param url: 请求链接
+    @return: httpx.Response
+    """
+    async with governor.arequest(url):
+        response = await get_client().get(url, **kwargs)
+    await governor.athrottle(len(response.content))
+    return response
+
+
+async def close_client():
+    """关闭当前事件循环的异步客户端"""
+    client = async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def get_course_by_cid(cid):
+    """
+    获取课程信息
+    @param cid: 课程ID
+    @return: 课程信息
+    """
+    course = cache.get('course', (cid,))
+    if course is not None:
+        return course
+    response = await get(urls.BasicInfoUri.format(cid=cid))
+    course = response.json()
+    cache.set('course', (cid,), course)
+    return course
+
+
+async def get_course_list_page(page):
+    """
+    获取课程列表的一页
+    @param page: 页码
+    @return: 响应 json
+    """
+    # count 参数最多为 10
+    response = await get(urls.CourseList, params={'page': page, 'count': '10'})
+    return response.json()
+
+
+async def get_all_courses(uin):
+    """
+    获取用户所有的课程
+    @param uin: 当前用户的 uin,作为缓存键,与 apis.get_all_courses 共用缓存
+    @return: 课程信息列表
+    """
+    courses = cache.get('courses', (uin,))
+    if courses is not None:
+        return courses
+
+    courses = []
+    page = 1
+    while True:
+        response_json = await get_course_list_page(page)
+        result = response_json.get('result')
+        if result:
+            for i in result.get('map_list'):
+                for j in i.get('map_courses'):
+                    courses.append({
+                        'name': j.get('cname'),
+                        'cid': j.get('cid')
+                    })
+        # result 不存在或 response.end != 0 代表有没有下一页
+        if not result or response_json.get('end') != 0:
+            break
+        page += 1
+
+    cache.set('courses', (uin,), courses)
+    return courses
+
+
+async def get_uin():
+    response = await get(urls.DefaultAccount)
+    response_json = response.json()
+    if response_json.get('retcode') == 0:
+        return response_json.get('result').get('tiny_id')
+    # 需要用户输入时不阻塞事件循环
+    return await asyncio.get_running_loop().run_in_executor(
+        None, input, '请输入你的QQ号 / 微信uin(回车结束)：'
+    )
+
+
+async def get_current_user():
+    """
+    获取当前用户信息,与 apis.get_current_user 共用 CURRENT_USER
+    @return: CURRENT_USER
+    """
+    lock = current_user_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+    async with lock:
+        if not CURRENT_USER:
+            set_current_user(await get_uin())
+    return CURRENT_USER
+
+
+async def get_key_url_token(cid, term_id):
+    """
+    获取 key_url 所需的 token
+    @param cid: 课程ID
+    @param term_id: 学期ID
+    @return: key_url_token
+    """
+    await get_current_user()
+    # 用户信息已经存在,apis.get_key_url_token 不会再发起请求
+    return build_key_url_token(cid, term_id)
+
+
+async def get_rec_video_info(cid, term_id, file_id):
+    """
+    获取视频信息
+    @param cid: 课程ID
+    @param term_id: 学期ID
+    @param file_id: 文件ID
+    @return: rec_video_info
+    """
+    rec_video_info = cache.get('rec_video_info', (cid, term_id, file_id))
+    if rec_video_info is not None:
+        return rec_video_info
+
+    user = await get_current_user()
+    header = {
+        "srv_appid": 201,
+        "cli_appid": "ke",
+        "uin": user.get('uin'),
+        "cli_info": {"cli_platform": 3}
+    }
+    params = {
+        "course_id": cid,
+        "term_id": term_id,
+        "file_id": file_id,
+        "header": json.dumps(header)
+    }
+    response = await get(urls.VideoRec, params=params)
+    rec_video_info = response.json().get('result').get('rec_video_info')
+    cache.set('rec_video_info', (cid, term_id, file_id), rec_video_info, rec_video_info_expire(rec_video_info))
+    return rec_video_info
+
+
+async def get_key_url_from_m3u8(m3u8_url):
+    """
+    从 m3u8 url 中获取秘钥链接
+    @param m3u8_url: 带有 sign,t,us 参数的 m3u8 下载链接
+    @return: 秘钥链接
+    """
+    response = await get(m3u8_url)
+    pattern = re.compile(r'(https://ke.qq.com/cgi-bin/qcloud/get_dk.+)"')
+    return pattern.findall(response.text)[0]
+
+
+async def get_video_url(cid, term_id, m3u8_url):
+    """
+    根据 m3u8_url 解析视频链接(ts_url)及秘钥链接(key_url)
+    @param cid: 课程ID
+    @param term_id: 学期ID
+    @param m3u8_url: m3u8_url
+    @return: ts_url,key_url
+    """
+    ts_url = m3u8_url.replace('.m3u8', '.ts')
+    key_url, token = await asyncio.gather(get_key_url_from_m3u8(m3u8_url), get_key_url_token(cid, term_id))
+    return ts_url, f"{key_url}&token={token}"
@@ -0,0 +1,141 @@
+"""
+CPU 部分的微基准测试
+每个用例重复 repeat 轮,每轮调用 number 次,取最快一轮的单次耗时,数据使用固定的随机数种子生成,
+可以保存为基线 json 并在之后比较
+
+  python benchmarks/bench_cpu.py
+  python benchmarks/bench_cpu.py --save cpu_baseline.json
+  python benchmarks/bench_cpu.py --baseline cpu_baseline.json --tolerance 0.2
+"""
+import argparse
+import io
+import random
+import sys
+import timeit
+from pathlib import Path
+
+from common import setup_offline, compare_baseline, load_json, save_json
+
+BASE_URL = 'https://example.com/video/index.m3u8'
+KEY_URL = 'https://ke.qq.com/cgi-bin/qcloud/get_dk?edk=bench&fileId=1&keyCodeType=0'
+# 比较基线时使用的指标 {指标: 是否越大越好}
+BASELINE_METRICS = {'per_call_us': False}
+
+
+def build_playlist(segments, seed=0):
+    """生成 segments 个分段的 m3u8 文件,分段链接为相对路径"""
+    rand = random.Random(seed)
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:10', '#EXT-X-MEDIA-SEQUENCE:0',
+             f'#EXT-X-KEY:METHOD=AES-128,URI="{KEY_URL}"']
+    start = 0
+    for i in range(segments):
+        size = rand.randrange(100_000, 1_000_000) // 16 * 16
+        lines.append(f'#EXTINF:{rand.uniform(5, 10):.3f},')
+        lines.append(f'v.f{i}.ts?start={start}&end={start + size - 1}&type=mpegts&t={rand.getrandbits(32):x}')
+        start += size
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def build_cases(args, workdir: Path):
+    """
+    @return: [(名称, 函数, 每轮调用次数, 每轮调用前的准备函数)]
+    """
+    from Crypto.Cipher import AES
+
+    import apis
+    from downloader import decrypt, decrypt_file
+    from downloader_m3u8 import get_url_list
+    from m3u8Utils import parse_m3u8, rewrite_m3u8
+    from ProgressBarUtils import DownloaderProgressBar, ProgressRenderer
+    from utils import parse_page
+
+    rand = random.Random(args.seed)
+    content = build_playlist(args.segments, args.seed)
+    cases = [
+        (f"parse_m3u8[{args.segments}]", lambda: parse_m3u8(BASE_URL, content), 1, None),
+        (f"get_url_list[{args.segments}]", lambda: get_url_list('https://example.com/video', content), 1, None),
+        (f"rewrite_m3u8[{args.segments}]", lambda: list(rewrite_m3u8(
+            content, BASE_URL, lambda key_url: f"{key_url}&token=bench", lambda i, ts_url: ts_url)), 1, None),
+    ]
+
+    apis.set_current_user('123456789')
+    cases.append(('get_key_url_token', lambda: (apis.CURRENT_USER['tokens'].clear(),
+                                                 apis.get_key_url_token(1, 2)), 1000, None))
+
+    key = rand.getrandbits(128).to_bytes(16, 'big')
+    for size in args.sizes:
+        iv = rand.getrandbits(128).to_bytes(16, 'big')
+        plain = rand.getrandbits(size * 8).to_bytes(size, 'big')
+        ciphertext = iv + AES.new(key, AES.MODE_CBC, iv).encrypt(plain)
+        cases.append((f"decrypt[{size}]", lambda c=ciphertext: decrypt(c, key), 1, None))
+
+        source = workdir.joinpath(f"{size}.enc")
+        source.write_bytes(ciphertext)
+        target = workdir.joinpath(f"{size}.ts")
+        # decrypt_file 原地替换,每轮前重新写入密文
+        cases.append((f"decrypt_file[{size}]", lambda t=target: decrypt_file(t, key), 1,
+                      lambda s=source, t=target: t.write_bytes(s.read_bytes())))
+
+    # 渲染器输出到内存中,测试的是下载线程调用 addition 的开销
+    bar = DownloaderProgressBar('bench', 1 << 40, renderer=ProgressRenderer(stream=io.StringIO()))
+    cases.append(('DownloaderProgressBar.addition', lambda: bar.addition(188), 100_000, None))
+
+    cases.append((f"parse_page[1-{args.pages}]", lambda: parse_page(f"1-{args.pages}"), 1, None))
+    ranges = ','.join(f"{i}-{i + 99}" for i in range(1, args.pages, 50))
+    cases.append((f"parse_page[{args.pages // 50} ranges]", lambda: parse_page(ranges), 1, None))
+    return cases
+
+
+def run_case(func, number, setup, repeat):
+    """
+    @return: 最快一轮的单次耗时(微秒)
+    """
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        seconds = timeit.timeit(func, number=number) / number
+        best = seconds if best is None else min(best, seconds)
+    return best * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU 部分的微基准测试')
+    parser.add_argument('--segments', type=int, default=10_000, help='m3u8 文件的分段数')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64 * 1024, 1024 * 1024, 16 * 1024 * 1024],
+                        help='解密测试的数据大小(字节),必须是 16 的倍数')
+    parser.add_argument('--pages', type=int, default=100_000, help='parse_page 的页码范围')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例的重复轮数')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--filter', help='只运行名称包含该字符串的用例')
+    parser.add_argument('--save', help='保存结果为基线 json')
+    parser.add_argument('--baseline', help='与基线 json 比较,有退化时返回 1')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对变化')
+    args = parser.parse_args()
+    # 之后会切换到临时目录
+    save_path = args.save and Path(args.save).resolve()
+    baseline_path = args.baseline and Path(args.baseline).resolve()
+
+    workdir = setup_offline()
+    results = {}
+    print(f"{'case':<40}{'per call':>16}")
+    for name, func, number, setup in build_cases(args, workdir):
+        if args.filter and args.filter not in name:
+            continue
+        per_call_us = run_case(func, number, setup, args.repeat)
+        results[name] = {'per_call_us': per_call_us}
+        print(f"{name:<40}{per_call_us:>13.3f} us")
+
+    if save_path:
+        save_json(save_path, results)
+    if baseline_path:
+        regressions = compare_baseline(results, load_json(baseline_path), BASELINE_METRICS, args.tolerance)
+        for regression in regressions:
+            print(f"退化: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
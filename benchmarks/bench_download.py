@@ -0,0 +1,224 @@
+"""
+下载路径端到端基准测试
+启动本地 HLS 服务器,每个下载路径在单独的子进程中运行(分别统计峰值内存),
+输出 MB/s,segments/s,p50/p99 请求延迟及峰值 RSS,并可以与保存的基线比较
+
+  python benchmarks/bench_download.py
+  python benchmarks/bench_download.py --latency 0.05 --jitter 0.2 --bandwidth 2000000 --error-rate 0.02
+  python benchmarks/bench_download.py --save baseline.json
+  python benchmarks/bench_download.py --baseline baseline.json --tolerance 0.15
+"""
+import argparse
+import asyncio
+import hashlib
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from common import setup_offline, percentile, compare_baseline, load_json, save_json
+
+PATHS = ['download_ts_split', 'download_ts_assemble', 'download_course', 'async_download', 'range_download', 'downloader_m3u8.download_ts']
+# 比较基线时使用的指标 {指标: 是否越大越好}
+BASELINE_METRICS = {'mb_s': True, 'segments_s': True, 'p99_ms': False, 'peak_rss_mb': False}
+
+
+def file_digest(*files):
+    digest = hashlib.sha256()
+    for file in files:
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存(MB),不支持的平台返回 None"""
+    # Linux 的 ru_maxrss 会继承 fork 时父进程的峰值,优先读取 VmHWM
+    status = Path('/proc/self/status')
+    if status.exists():
+        match = re.search(r'VmHWM:\s+(\d+) kB', status.read_text())
+        if match:
+            return int(match.group(1)) / 1024
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位是字节,Linux 是 KB
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def run_path(path, base_url):
+    """
+    子进程中运行一个下载路径
+    @return: (耗时, 下载的分段数, 输出文件的摘要)
+    """
+    workdir = setup_offline()
+    from m3u8Utils import parse_m3u8_segments, download_ts_split
+    from keystore import key_store
+    from ProgressBarUtils import DownloaderProgressBar, progress_renderer
+    from settings import DOWNLOAD_WORKERS
+
+    m3u8_url = f"{base_url}/index.m3u8"
+    output = workdir.joinpath('output')
+    output.mkdir()
+    key_url, ts_urls, ivs = parse_m3u8_segments(m3u8_url)
+    key = key_store.get(key_url)
+    segments = len(ts_urls)
+
+    start = time.perf_counter()
+    if path == 'download_ts_split':
+        with DownloaderProgressBar('split', 0) as progress_bar:
+            files = download_ts_split(ts_urls, key, output, progress_bar, workers=DOWNLOAD_WORKERS, ivs=ivs)
+        elapsed = time.perf_counter() - start
+        digest = file_digest(*files)
+    elif path == 'download_ts_assemble':
+        from m3u8Utils import download_ts_assemble
+        with DownloaderProgressBar('assemble', 0) as progress_bar:
+            download_ts_assemble(ts_urls, key, output.joinpath('video.ts'), progress_bar,
+                                 workers=DOWNLOAD_WORKERS, ivs=ivs)
+        elapsed = time.perf_counter() - start
+        digest = file_digest(output.joinpath('video.ts'))
+    elif path == 'download_course':
+        from apis import download_course, get_output_path
+        output_path = output.joinpath('video.mp4')
+        download_course(m3u8_url, 0, 0, output_path, mode='stream', resolved=(key, ts_urls, ivs))
+        elapsed = time.perf_counter() - start
+        digest = file_digest(get_output_path(output_path, 'stream'))
+    elif path in ('async_download', 'range_download'):
+        import downloader
+        asyncio.run(getattr(downloader, path)(f"{base_url}/video.ts", output, 'video.ts', key=key))
+        elapsed = time.perf_counter() - start
+        segments = 0
+        digest = file_digest(output.joinpath('video.ts'))
+    elif path == 'downloader_m3u8.download_ts':
+        from downloader_m3u8 import download_ts
+        file = download_ts(m3u8_url, output, 'raw.ts')
+        elapsed = time.perf_counter() - start
+        digest = file_digest(file)
+    else:
+        raise ValueError(f"未知的下载路径 {path}")
+    progress_renderer.stop()
+    return elapsed, segments, digest
+
+
+def run_worker(args):
+    elapsed, segments, digest = run_path(args.worker, args.base_url)
+    save_json(args.result, {'elapsed': elapsed, 'segments': segments, 'digest': digest, 'peak_rss_mb': peak_rss_mb()})
+
+
+def bench(server, path, verbose=False):
+    """在子进程中运行一个下载路径,返回统计结果"""
+    server.reset_stats()
+    result_file = Path(server.workdir, f"{path}.json")
+    cmd = [sys.executable, __file__, '--worker', path, '--base-url', server.base_url, '--result', str(result_file)]
+    output = None if verbose else subprocess.DEVNULL
+    returncode = subprocess.call(cmd, stdout=output, stderr=output)
+    if returncode != 0:
+        return {'error': f"子进程返回 {returncode}"}
+
+    data = load_json(result_file)
+    # 明文路径与服务器的明文比较,downloader_m3u8 只下载不解密
+    expected = server.cipher_digest if path == 'downloader_m3u8.download_ts' else server.plain_digest
+    size = len(server.video) - 16 if data['segments'] == 0 else sum(map(len, server.segments))
+    latencies = [seconds * 1000 for seconds in server.latencies]
+    return {
+        'mb_s': size / 1024 / 1024 / data['elapsed'],
+        'segments_s': data['segments'] / data['elapsed'] if data['segments'] else None,
+        'p50_ms': percentile(latencies, 0.5),
+        'p99_ms': percentile(latencies, 0.99),
+        'peak_rss_mb': data['peak_rss_mb'],
+        'errors': server.errors,
+        'elapsed': data['elapsed'],
+        'verified': data['digest'] == expected,
+    }
+
+
+def median_result(runs):
+    """多次运行取各指标的中位数"""
+    runs = [run for run in runs if 'error' not in run]
+    if not runs:
+        return {'error': '全部运行失败'}
+    result = {}
+    for name in runs[0]:
+        values = [run[name] for run in runs if run[name] is not None]
+        if name == 'verified':
+            result[name] = all(values)
+        else:
+            result[name] = percentile(values, 0.5)
+    return result
+
+
+def print_report(results):
+    def fmt(value, spec):
+        return '-'.rjust(int(spec.split('.')[0])) if value is None else format(value, spec)
+
+    print(f"{'path':<30}{'MB/s':>10}{'seg/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>10}{'errors':>8}  verified")
+    for path, result in results.items():
+        if 'error' in result:
+            print(f"{path:<30}{result['error']}")
+            continue
+        print(
+            f"{path:<30}{fmt(result['mb_s'], '10.2f')}{fmt(result['segments_s'], '10.1f')}"
+            f"{fmt(result['p50_ms'], '10.1f')}{fmt(result['p99_ms'], '10.1f')}"
+            f"{fmt(result['peak_rss_mb'], '10.1f')}{result['errors']:>8}  {result['verified']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载路径端到端基准测试')
+    parser.add_argument('--paths', nargs='+', choices=PATHS, default=PATHS, help='需要测试的下载路径')
+    parser.add_argument('--segments', type=int, default=100, help='分段数')
+    parser.add_argument('--segment-size', type=int, default=256 * 1024, help='每个分段的大小(字节)')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='每个请求额外的随机延迟上限(秒)')
+    parser.add_argument('--bandwidth', type=int, default=None, help='每个连接的带宽上限(字节/秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='分段请求返回 503 的概率')
+    parser.add_argument('--repeat', type=int, default=1, help='每个路径运行次数,结果取中位数')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--save', help='保存结果为基线 json')
+    parser.add_argument('--baseline', help='与基线 json 比较,有退化时返回 1')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='允许的相对变化')
+    parser.add_argument('--verbose', action='store_true', help='显示子进程的输出')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_worker(args)
+    # 之后会切换到临时目录
+    save_path = args.save and Path(args.save).resolve()
+    baseline_path = args.baseline and Path(args.baseline).resolve()
+
+    workdir = setup_offline()
+    from hls_server import HLSServer
+
+    server = HLSServer(args.segments, args.segment_size, args.latency, args.jitter, args.bandwidth,
+                       args.error_rate, args.seed).start()
+    server.workdir = workdir
+    results = {path: median_result([bench(server, path, args.verbose) for _ in range(args.repeat)])
+               for path in args.paths}
+    server.shutdown()
+    print_report(results)
+
+    # 只有相同的服务器设置下的结果才有可比性
+    config = {name: getattr(args, name) for name in
+              ('segments', 'segment_size', 'latency', 'jitter', 'bandwidth', 'error_rate', 'seed')}
+    if save_path:
+        save_json(save_path, {'config': config, 'results': results})
+    if baseline_path:
+        baseline = load_json(baseline_path)
+        if baseline['config'] != config:
+            print(f"警告: 基线的服务器设置不同 {baseline['config']}")
+        regressions = compare_baseline(results, baseline['results'], BASELINE_METRICS, args.tolerance)
+        for regression in regressions:
+            print(f"退化: {regression}")
+        if regressions or not all(result.get('verified') for result in results.values()):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
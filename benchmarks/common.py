@@ -0,0 +1,73 @@
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def setup_offline():
+    """
+    准备离线运行环境
+    切换到临时目录并写入空的 cookies.json(settings 会在当前目录创建 courses,cache 目录,
+    cookies 存在 cookies.json 时不会读取浏览器),清除代理环境变量,使请求直接发送到本地服务器
+    必须在导入项目模块之前调用,退出时删除临时目录
+    @return: 临时目录
+    """
+    workdir = Path(tempfile.mkdtemp(prefix='qcourse-bench-'))
+    atexit.register(shutil.rmtree, workdir, True)
+    workdir.joinpath('cookies.json').write_text('{}')
+    os.chdir(workdir)
+    for name in list(os.environ):
+        if name.lower().endswith('_proxy'):
+            del os.environ[name]
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    return workdir
+
+
+def percentile(values, p):
+    """
+    @param values: 样本
+    @param p: 分位,0 ~ 1
+    @return: 分位值,没有样本时为 None
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def compare_baseline(results, baseline, metrics, tolerance):
+    """
+    与基线比较
+    @param results: 本次结果 {名称: {指标: 值}}
+    @param baseline: 基线结果,格式相同
+    @param metrics: 需要比较的指标 {指标: 是否越大越好}
+    @param tolerance: 允许的相对变化,如 0.1 表示 10%
+    @return: 退化的描述列表
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in metrics.items():
+            value, base_value = result.get(metric), base.get(metric)
+            if not value or not base_value:
+                continue
+            change = (value - base_value) / base_value
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{name} {metric}: {base_value:.4g} -> {value:.4g} ({change:+.1%})")
+    return regressions
+
+
+def load_json(path):
+    return json.loads(Path(path).read_text(encoding='utf-8'))
+
+
+def save_json(path, data):
+    Path(path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
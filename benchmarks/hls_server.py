@@ -0,0 +1,166 @@
+"""
+本地 HLS 测试服务器
+提供 AES-128 加密的 m3u8 播放列表,ts 分段,秘钥以及整个加密的视频文件,可以模拟延迟,带宽限制和错误
+
+  /index.m3u8       播放列表,分段使用媒体序号作为初始向量
+  /key              秘钥
+  /seg/{i}.ts       第 i 个分段,链接带有 start,end 参数(与腾讯课堂的 ts 链接一致)
+  /video.ts         整个视频,前 16 字节为初始向量,支持 Range
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from Crypto.Cipher import AES
+
+CHUNK_SIZE = 16 * 1024
+
+
+class HLSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, segments=100, segment_size=256 * 1024, latency=0.0, jitter=0.0, bandwidth=None,
+                 error_rate=0.0, seed=0, port=0):
+        """
+        @param segments: 分段数
+        @param segment_size: 每个分段的大小(字节),会向下取整为 16 的倍数
+        @param latency: 每个请求的固定延迟(秒)
+        @param jitter: 每个请求额外的随机延迟上限(秒)
+        @param bandwidth: 每个连接的带宽上限(字节/秒),为空时不限制
+        @param error_rate: 分段请求返回 503 的概率
+        @param seed: 随机数种子,相同的种子生成相同的数据
+        @param port: 端口,0 表示随机端口
+        """
+        super().__init__(('127.0.0.1', port), HLSRequestHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        segment_size -= segment_size % AES.block_size
+        self.key = self.random_bytes(AES.block_size)
+        plain = [self.random_bytes(segment_size) for _ in range(segments)]
+        # 明文末尾不能是 \0,否则整个文件解密后会被当做填充去掉
+        plain[-1] = plain[-1][:-1] + b'\x47'
+        self.segments = [
+            AES.new(self.key, AES.MODE_CBC, i.to_bytes(16, 'big')).encrypt(segment)
+            for i, segment in enumerate(plain)
+        ]
+        iv = self.random_bytes(AES.block_size)
+        self.video = iv + AES.new(self.key, AES.MODE_CBC, iv).encrypt(b''.join(plain))
+        self.plain_digest = hashlib.sha256(b''.join(plain)).hexdigest()
+        self.cipher_digest = hashlib.sha256(b''.join(self.segments)).hexdigest()
+        self.playlist = self.build_playlist(segment_size)
+
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def random_bytes(self, size):
+        return self.random.getrandbits(size * 8).to_bytes(size, 'little')
+
+    def build_playlist(self, segment_size):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:10',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            # 与腾讯课堂一致,秘钥使用完整链接
+            f'#EXT-X-KEY:METHOD=AES-128,URI="{self.base_url}/key"',
+        ]
+        for i in range(len(self.segments)):
+            lines.append('#EXTINF:10.0,')
+            lines.append(f"/seg/{i}.ts?start={i * segment_size}&end={(i + 1) * segment_size - 1}")
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def record(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def reset_stats(self):
+        """清空请求记录,每次测试前调用"""
+        with self.lock:
+            self.latencies = []
+            self.errors = 0
+
+    def start(self):
+        """在后台线程中运行"""
+        threading.Thread(target=self.serve_forever, name='hls-server', daemon=True).start()
+        return self
+
+
+class HLSRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: HLSServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        start = time.perf_counter()
+        server = self.server
+        path = urlparse(self.path).path
+        delay = server.latency + (server.random.uniform(0, server.jitter) if server.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        if path == '/index.m3u8':
+            return self.send_body(server.playlist.encode(), 'application/vnd.apple.mpegurl')
+        if path == '/key':
+            return self.send_body(server.key, 'application/octet-stream')
+
+        match = re.fullmatch(r'/seg/(\d+)\.ts', path)
+        if match and int(match.group(1)) < len(server.segments):
+            if server.error_rate and server.random.random() < server.error_rate:
+                with server.lock:
+                    server.errors += 1
+                return self.send_body(b'', status=503)
+            self.send_body(server.segments[int(match.group(1))], 'video/mp2t')
+            return server.record(time.perf_counter() - start)
+        if path == '/video.ts':
+            self.send_range(server.video)
+            return server.record(time.perf_counter() - start)
+        self.send_body(b'', status=404)
+
+    def send_range(self, data):
+        """整个文件,支持单个 Range"""
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if not match:
+            return self.send_body(data, 'video/mp2t')
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Range', f"bytes */{len(data)}")
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        self.send_body(data[start:end + 1], 'video/mp2t', status=206,
+                       headers={'Content-Range': f"bytes {start}-{end}/{len(data)}"})
+
+    def send_body(self, body, content_type='text/plain', status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        view = memoryview(body)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            chunk = view[offset:offset + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
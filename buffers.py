@@ -0,0 +1,173 @@
+import ctypes
+import ctypes.util
+import os
+from threading import Lock
+
+from settings import RECEIVE_READ_SIZE, BUFFER_POOL_SIZE
+
+# Linux fallocate 的 FALLOC_FL_KEEP_SIZE,预留磁盘空间但不改变文件大小
+FALLOC_FL_KEEP_SIZE = 1
+try:
+    _fallocate = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).fallocate
+    _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+except (OSError, AttributeError, TypeError):
+    # 非 Linux 系统
+    _fallocate = None
+
+
+class BufferPool:
+    """
+    接收缓冲区池
+    复用 bytearray,避免每个 ts 文件都重新分配内存;缓冲区用完后需要放回
+    """
+
+    def __init__(self, max_buffers=BUFFER_POOL_SIZE):
+        """
+        @param max_buffers: 最多缓存的缓冲区数量,超过时放回的缓冲区直接丢弃
+        """
+        self.max_buffers = max_buffers
+        self.buffers = []
+        self.lock = Lock()
+
+    def get(self, size):
+        """
+        取出一个缓冲区
+        @param size: 最小大小
+        @return: 大小不小于 size 的 bytearray
+        """
+        with self.lock:
+            for i, buffer in enumerate(self.buffers):
+                if len(buffer) >= size:
+                    return self.buffers.pop(i)
+        return bytearray(size)
+
+    def put(self, buffer):
+        """
+        放回缓冲区,放回后不能再使用其中的数据
+        @param buffer: bytearray 或者它的 memoryview
+        """
+        if isinstance(buffer, memoryview):
+            buffer = buffer.obj
+        if not isinstance(buffer, bytearray):
+            return
+        with self.lock:
+            if len(self.buffers) < self.max_buffers:
+                self.buffers.append(buffer)
+
+
+buffer_pool = BufferPool()
+
+
+def get_reader(raw):
+    """
+    获取响应的 readinto 函数
+    没有压缩时直接使用 http.client 的 readinto,数据从 socket 直接读入缓冲区;
+    否则使用 urllib3 的 readinto,由 urllib3 解压
+    @param raw: requests 响应的 raw(urllib3.HTTPResponse)
+    @return: readinto 函数
+    """
+    fp = getattr(raw, '_fp', None)
+    if fp is not None and hasattr(fp, 'readinto') and not raw.headers.get('content-encoding'):
+        return fp.readinto
+    return raw.readinto
+
+
+def read_chunks(response, buffer, on_chunk=None):
+    """
+    将 stream 响应依次读入 buffer,读取大小在 RECEIVE_READ_SIZE 范围内自适应
+    @param response: requests 的 stream 响应
+    @param buffer: 接收缓冲区
+    @param on_chunk: 每次读取后调用 on_chunk(字节数),用于限速,检查超时等
+    @return: 生成器,产生每次读取的 memoryview,下一次读取前有效
+    """
+    readinto = get_reader(response.raw)
+    read_size, max_read_size = RECEIVE_READ_SIZE
+    view = memoryview(buffer)
+    while True:
+        count = readinto(view[:min(read_size, len(view))])
+        if not count:
+            break
+        if count >= read_size:
+            read_size = min(read_size * 2, max_read_size)
+        if on_chunk:
+            on_chunk(count)
+        yield view[:count]
+    # 内容已经读完,连接可以放回连接池复用
+    response.raw.release_conn()
+
+
+def receive(response, size_hint=None, on_chunk=None):
+    """
+    将整个 stream 响应读入缓冲池中的缓冲区
+    缓冲区大小优先使用 content-length,其次是 size_hint,内容超出时换成两倍大小的缓冲区
+    @param response: requests 的 stream 响应
+    @param size_hint: 预计大小
+    @param on_chunk: 每次读取后调用 on_chunk(字节数)
+    @return: 内容的 memoryview,用完后通过 buffer_pool.put 放回
+    """
+    content_length = int(response.headers.get('content-length') or 0)
+    # 压缩的响应解压后的大小与 content-length 不同,只能读到结束为止
+    expected = None if response.headers.get('content-encoding') else content_length or None
+    buffer = buffer_pool.get(content_length or size_hint or RECEIVE_READ_SIZE[1])
+    readinto = get_reader(response.raw)
+    read_size, max_read_size = RECEIVE_READ_SIZE
+    received = 0
+    try:
+        while received != expected:
+            if received == len(buffer):
+                # 缓冲区正好读满时先试读一个字节,已经读完就不需要换更大的缓冲区
+                probe = bytearray(1)
+                if not readinto(probe):
+                    break
+                bigger = bytearray(len(buffer) * 2)
+                bigger[:received] = buffer
+                bigger[received] = probe[0]
+                buffer_pool.put(buffer)
+                buffer = bigger
+                received += 1
+                if on_chunk:
+                    on_chunk(1)
+                continue
+            count = readinto(memoryview(buffer)[received:received + read_size])
+            if not count:
+                break
+            if count >= read_size:
+                read_size = min(read_size * 2, max_read_size)
+            received += count
+            if on_chunk:
+                on_chunk(count)
+    except BaseException:
+        # 超时或取消时放回缓冲区,内容已经没有用处
+        buffer_pool.put(buffer)
+        raise
+    response.raw.release_conn()
+    return memoryview(buffer)[:received]
+
+
+def reserve_space(f, size):
+    """
+    为顺序写入的文件预留磁盘空间,不改变文件大小,断点续传仍然可以使用文件大小
+    只在 Linux 上生效,文件系统不支持时忽略
+    @param f: 打开的文件
+    @param size: 预计的文件大小
+    """
+    if _fallocate is None or not size:
+        return
+    f.flush()
+    _fallocate(f.fileno(), FALLOC_FL_KEEP_SIZE, 0, size)
+
+
+def preallocate(f, size):
+    """
+    为按位置写入的文件分配空间,文件大小变为 size
+    优先使用 posix_fallocate 实际分配磁盘空间,不支持时使用 truncate(稀疏文件)
+    @param f: 打开的文件
+    @param size: 文件大小
+    """
+    f.flush()
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+        # 文件原本更大时 posix_fallocate 不会截断
+        f.truncate(size)
+    except (AttributeError, OSError):
+        f.truncate(size)
@@ -0,0 +1,152 @@
+import functools
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from logger import logger
+from settings import CACHE_PATH, CACHE_TTL, CACHE_MAX_AGE, CACHE_MAX_SIZE, URL_EXPIRE_MARGIN
+from utils import get_url_expire
+
+
+class FileCache:
+    """
+    接口数据缓存
+    每个接口(endpoint)一个目录,每条数据一个 json 文件,记录数据及过期时间
+    数据过期或超过最长保存时间时删除,总大小超过上限时优先删除最旧的数据
+    """
+
+    def __init__(self, path: Path = CACHE_PATH, ttl=None, max_age=CACHE_MAX_AGE, max_size=CACHE_MAX_SIZE):
+        """
+        @param path: 缓存目录
+        @param ttl: 每个接口的缓存时间(秒) {endpoint: ttl},不在其中的接口不缓存
+        @param max_age: 缓存文件最长保存时间(秒)
+        @param max_size: 缓存目录大小上限(字节)
+        """
+        self.path = path
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self.max_age = max_age
+        self.max_size = max_size
+        self.evict()
+
+    def get_file(self, endpoint, key):
+        """
+        缓存文件路径
+        @param endpoint: 接口名
+        @param key: 缓存键,可以被 json 序列化的对象
+        @return: 缓存文件路径
+        """
+        digest = hashlib.md5(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return self.path.joinpath(endpoint, f"{digest}.json")
+
+    def get(self, endpoint, key, default=None):
+        """
+        读取缓存
+        @param endpoint: 接口名
+        @param key: 缓存键
+        @param default: 没有缓存或缓存过期时返回的值
+        @return: 缓存数据
+        """
+        file = self.get_file(endpoint, key)
+        try:
+            data = json.loads(file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return default
+        if data.get('expire', 0) < time.time():
+            file.unlink(missing_ok=True)
+            return default
+        return data.get('value')
+
+    def set(self, endpoint, key, value, expire=None):
+        """
+        写入缓存
+        @param endpoint: 接口名
+        @param key: 缓存键
+        @param value: 缓存数据
+        @param expire: 数据自身的过期时间戳(如签名链接的过期时间),与接口缓存时间取较早者
+        """
+        ttl = self.ttl.get(endpoint)
+        if not ttl:
+            return
+        expire_time = time.time() + ttl
+        if expire is not None:
+            expire_time = min(expire_time, expire)
+        if expire_time <= time.time():
+            return
+        file = self.get_file(endpoint, key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps({'expire': expire_time, 'value': value}, ensure_ascii=False),
+                            encoding='utf-8')
+        os.replace(tmp_file, file)
+
+    def invalidate(self, endpoint=None):
+        """
+        清除缓存
+        @param endpoint: 接口名,为空时清除所有接口的缓存
+        """
+        directories = [self.path.joinpath(endpoint)] if endpoint else self.path.iterdir()
+        for directory in directories:
+            if not directory.is_dir():
+                continue
+            for file in directory.glob('*.json'):
+                file.unlink(missing_ok=True)
+        logger.info(f"清除缓存 {endpoint or '全部'}")
+
+    def evict(self):
+        """删除超过最长保存时间的缓存,总大小超过上限时删除最旧的缓存"""
+        now = time.time()
+        files = []
+        for file in self.path.glob('*/*.json'):
+            stat = file.stat()
+            if now - stat.st_mtime > self.max_age:
+                file.unlink(missing_ok=True)
+            else:
+                files.append((stat.st_mtime, stat.st_size, file))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total <= self.max_size:
+                break
+            file.unlink(missing_ok=True)
+            total -= size
+
+    def cached(self, endpoint, expire=None):
+        """
+        读穿缓存装饰器,以函数参数作为缓存键
+        @param endpoint: 接口名
+        @param expire: 从返回值中获取过期时间戳的函数 expire(value)->timestamp
+        @return: 装饰器
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                value = self.get(endpoint, args)
+                if value is not None:
+                    return value
+                value = func(*args)
+                if value is not None:
+                    self.set(endpoint, args, value, expire(value) if expire else None)
+                return value
+
+            return wrapper
+
+        return decorator
+
+
+def rec_video_info_expire(rec_video_info):
+    """
+    视频信息中的链接带有签名,签名过期后链接不可用
+    @param rec_video_info: 视频信息
+    @return: 最早过期的链接的过期时间戳,预留 URL_EXPIRE_MARGIN 秒用于下载
+    """
+    expires = [get_url_expire(info.get('url')) for info in rec_video_info.get('infos', [])]
+    expires = [expire for expire in expires if expire]
+    if expires:
+        return min(expires) - URL_EXPIRE_MARGIN
+    return None
+
+
+cache = FileCache()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from threading import RLock
+from urllib.parse import urlsplit
+
+from settings import CHECKPOINT_SAVE_INTERVAL
+from utils import get_ts_range
+
+
+def playlist_fingerprint(ts_urls):
+    """
+    播放列表指纹,由 ts 数量及去掉签名参数的 ts 路径和范围生成
+    同一个秘钥下选择了不同的清晰度或者 ts 列表变化时,指纹不同
+    @param ts_urls: ts 文件链接列表
+    @return: 指纹字符串
+    """
+    digest = hashlib.sha1(str(len(ts_urls)).encode())
+    for ts_url in ts_urls:
+        digest.update(f"\n{urlsplit(ts_url).path}{get_ts_range(ts_url) or ''}".encode())
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """
+    下载断点记录
+    以 json 文件的形式保存在分段文件旁边,记录已完成的分段及其大小,以及下载时使用的秘钥和播放列表指纹
+    秘钥或指纹不同时视为新的下载,之前的记录作废;
+    记录最多每隔 save_interval 秒写入一次文件,下载结束或出错时需要调用 flush
+    """
+
+    def __init__(self, path: Path, key=None, fingerprint=None, save_interval=CHECKPOINT_SAVE_INTERVAL):
+        """
+        @param path: 记录文件路径
+        @param key: 下载使用的秘钥(bytes)或其他能标识这次下载的字符串
+        @param fingerprint: 播放列表指纹,见 playlist_fingerprint
+        @param save_interval: 写入文件的最小间隔(秒)
+        """
+        self.path = path
+        self.key = key.hex() if isinstance(key, bytes) else key
+        self.fingerprint = fingerprint
+        self.save_interval = save_interval
+        self.dirty = False
+        self.save_time = float('-inf')
+        self.segments = {}
+        self.load()
+
+    def load(self):
+        """读取记录文件"""
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+        except ValueError:
+            # 记录文件损坏,重新下载
+            return
+        if data.get('key') == self.key and data.get('fingerprint') == self.fingerprint:
+            self.segments = {int(index): size for index, size in data.get('segments', {}).items()}
+
+    def save(self):
+        """保存记录文件,先写临时文件再替换,避免中断时记录文件损坏"""
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps({'key': self.key, 'fingerprint': self.fingerprint, 'segments': self.segments}))
+        os.replace(tmp_path, self.path)
+
+    def changed(self):
+        """记录有变化,距离上次写入超过 save_interval 秒时写入文件"""
+        self.dirty = True
+        if time.monotonic() - self.save_time >= self.save_interval:
+            self.flush()
+
+    def flush(self):
+        """有未写入的变化时写入文件"""
+        if self.dirty:
+            self.save()
+            self.dirty = False
+            self.save_time = time.monotonic()
+
+    def is_done(self, index, file: Path = None):
+        """
+        分段是否已经下载完成
+        @param index: 分段索引
+        @param file: 分段文件,存在时会同时检查文件大小
+        @return: bool
+        """
+        size = self.segments.get(index)
+        if size is None:
+            return False
+        if file is not None:
+            return file.exists() and file.stat().st_size == size
+        return True
+
+    def done(self, index, size):
+        """
+        记录分段下载完成
+        @param index: 分段索引
+        @param size: 分段大小
+        """
+        self.segments[index] = size
+        self.changed()
+
+    def remove(self):
+        """下载全部完成后删除记录文件"""
+        self.dirty = False
+        if self.path.exists():
+            self.path.unlink()
+
+
+class BitmapCheckpoint(Checkpoint):
+    """
+    按位记录的下载断点
+    用于乱序写入同一个文件,每个分段在文件中的位置和大小事先已知,只需记录是否完成;
+    多个线程可以同时调用 done
+    """
+
+    def __init__(self, path: Path, key=None, count=0, fingerprint=None, save_interval=CHECKPOINT_SAVE_INTERVAL):
+        """
+        @param path: 记录文件路径
+        @param key: 下载使用的秘钥(bytes)或其他能标识这次下载的字符串
+        @param count: 分段数
+        @param fingerprint: 播放列表指纹,见 playlist_fingerprint
+        @param save_interval: 写入文件的最小间隔(秒)
+        """
+        self.count = count
+        self.bitmap = bytearray((count + 7) // 8)
+        self.lock = RLock()
+        super().__init__(path, key, fingerprint, save_interval)
+
+    def load(self):
+        """读取记录文件,分段数不同时视为新的下载"""
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+            bitmap = bytearray.fromhex(data.get('bitmap', ''))
+        except ValueError:
+            return
+        if (data.get('key') == self.key and data.get('fingerprint') == self.fingerprint
+                and data.get('count') == self.count and len(bitmap) == len(self.bitmap)):
+            self.bitmap = bitmap
+
+    def save(self):
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps({
+            'key': self.key,
+            'fingerprint': self.fingerprint,
+            'count': self.count,
+            'bitmap': self.bitmap.hex(),
+        }))
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """清空记录"""
+        with self.lock:
+            self.bitmap = bytearray(len(self.bitmap))
+
+    def flush(self):
+        with self.lock:
+            super().flush()
+
+    def is_done(self, index, file: Path = None):
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def done(self, index, size=None):
+        """
+        记录分段完成
+        @param index: 分段索引
+        @param size: 不使用,分段大小事先已知
+        """
+        with self.lock:
+            self.bitmap[index >> 3] |= 1 << (index & 7)
+            self.changed()
@@ -0,0 +1,116 @@
+from contextlib import ExitStack
+
+import httpx
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cookies import cookies
+from governor import governor
+from metrics import api_seconds, get_endpoint
+from settings import DEFAULT_HEADERS, PROXIES, DOMAIN, HTTP_TIMEOUT, HTTP_RETRIES, HTTP_POOL_SIZE, HTTP_HOST_POOL_SIZES
+
+
+class Client(Session):
+    """
+    共享的 HTTP 客户端
+    复用连接池(keep-alive),统一设置 headers,proxies,cookies,超时以及重试策略
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, pool_size=HTTP_POOL_SIZE, host_pool_sizes=None):
+        """
+        @param timeout: 默认超时时间,(连接超时, 读取超时)
+        @param retries: 连接失败或服务器错误时的重试次数
+        @param pool_size: 每个 host 的默认连接池大小
+        @param host_pool_sizes: 指定 host 的连接池大小 {url 前缀: 连接池大小}
+        """
+        super().__init__()
+        self.timeout = timeout
+        self.headers.update(DEFAULT_HEADERS)
+        self.proxies.update(PROXIES)
+        # cookie 只发送给腾讯课堂,不发送给视频 CDN
+        for name, value in cookies.items():
+            self.cookies.set(name, value, domain=f".{DOMAIN}")
+
+        self.retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            # 不重试时服务器错误直接返回给调用方处理
+            status_forcelist=(429, 500, 502, 503, 504) if retries else (),
+        )
+        self.mount('http://', self.create_adapter(pool_size))
+        self.mount('https://', self.create_adapter(pool_size))
+        for prefix, size in (host_pool_sizes or {}).items():
+            self.mount(prefix, self.create_adapter(size))
+
+    def create_adapter(self, pool_size):
+        """
+        创建连接池适配器
+        @param pool_size: 连接池大小
+        @return: HTTPAdapter
+        """
+        return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=self.retry)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        # 受 host 连接数及请求数限制,stream 请求的内容由调用方读取时限速
+        endpoint = get_endpoint(url)
+        with ExitStack() as stack:
+            stack.enter_context(governor.request(url))
+            if endpoint:
+                with api_seconds.time(endpoint=endpoint):
+                    response = super().request(method, url, **kwargs)
+            else:
+                response = super().request(method, url, **kwargs)
+            if kwargs.get('stream'):
+                # 读取内容时仍然占用连接,关闭响应时才归还许可
+                self.release_on_close(response, stack.pop_all())
+                return response
+        governor.throttle(len(response.content))
+        return response
+
+    @staticmethod
+    def release_on_close(response, stack):
+        """
+        关闭响应时退出 stack
+        @param response: stream 响应
+        @param stack: ExitStack
+        """
+        close = response.close
+
+        def close_response():
+            try:
+                close()
+            finally:
+                stack.close()
+
+        response.close = close_response
+
+
+client = Client(host_pool_sizes=HTTP_HOST_POOL_SIZES)
+# 下载 ts 文件使用,失败后由 hedger 退避重试,不在连接层重复重试
+segment_client = Client(retries=0)
+
+
+def create_async_client(timeout=HTTP_TIMEOUT, pool_size=HTTP_POOL_SIZE):
+    """
+    创建异步 HTTP 客户端,与 client 使用相同的 headers,proxies,cookies 及超时设置
+    httpx.AsyncClient 只能在创建它的事件循环中使用
+    @param timeout: 超时时间,(连接超时, 读取超时)
+    @param pool_size: 连接池大小
+    @return: httpx.AsyncClient
+    """
+    connect_timeout, read_timeout = timeout
+    async_cookies = httpx.Cookies()
+    for name, value in cookies.items():
+        async_cookies.set(name, value, domain=f".{DOMAIN}")
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    return httpx.AsyncClient(
+        headers=DEFAULT_HEADERS,
+        cookies=async_cookies,
+        proxies={f"{scheme}://": proxy for scheme, proxy in PROXIES.items() if scheme in ('http', 'https')} or None,
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=limits,
+        # 连接失败时重试
+        transport=httpx.AsyncHTTPTransport(limits=limits, retries=HTTP_RETRIES),
+    )
@@ -0,0 +1,155 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from Crypto.Cipher import AES
+
+from metrics import decrypt_seconds
+from profiler import profiler
+from settings import DECRYPT_WORKERS, DECRYPT_CHUNK_SIZE
+
+
+class DecryptPool:
+    """
+    AES-CBC 解密线程池
+    pycryptodome 调用底层 C 实现时会释放 GIL,多个线程可以同时使用多个核心解密
+    可写的缓冲区(bytearray/memoryview)原地解密,不产生额外的拷贝
+    """
+
+    def __init__(self, workers=DECRYPT_WORKERS):
+        """
+        @param workers: 解密线程数,为空时使用 CPU 核心数
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='decrypt')
+        self.lock = Lock()
+        self.bytes = 0
+        self.busy_time = 0.0
+
+    def decrypt_into(self, buffer, key, iv):
+        """
+        解密缓冲区
+        @param buffer: 密文,可写时原地解密
+        @param key: 秘钥
+        @param iv: 初始向量
+        @return: 明文 memoryview
+        """
+        start = time.perf_counter()
+        view = memoryview(buffer)
+        output = view if not view.readonly else memoryview(bytearray(len(view)))
+        with profiler.phase('decrypt'):
+            AES.new(key, AES.MODE_CBC, iv).decrypt(view, output=output)
+        cost = time.perf_counter() - start
+        decrypt_seconds.observe(cost)
+        with self.lock:
+            self.bytes += len(view)
+            self.busy_time += cost
+        return output
+
+    def submit(self, index, buffer, key, iv=None):
+        """
+        提交解密任务
+        @param index: 分段索引,原样返回
+        @param buffer: 密文
+        @param key: 秘钥
+        @param iv: 初始向量,默认使用 key
+        @return: Future,结果为 (索引, 明文 memoryview)
+        """
+        return self.executor.submit(profiler.bind(lambda: (index, self.decrypt_into(buffer, key, iv or key))))
+
+    def decrypt_stream(self, reader, key, iv=None, chunk_size=DECRYPT_CHUNK_SIZE):
+        """
+        分块读取并解密 CBC 密文,内存占用与文件大小无关
+        每一块的初始向量为前一块密文的最后 16 字节,最多同时解密 workers 的两倍个块
+        @param reader: 可读的二进制文件对象
+        @param key: 秘钥
+        @param iv: 初始向量,为空时使用密文的前 16 字节
+        @param chunk_size: 每块大小,必须是 16 的倍数
+        @return: 生成器,按顺序产生明文 memoryview
+        """
+        if iv is None:
+            iv = reader.read(AES.block_size)
+        pending = deque()
+        while True:
+            buffer = bytearray(chunk_size)
+            size = reader.readinto(buffer)
+            if not size:
+                break
+            chunk = memoryview(buffer)[:size]
+            # 原地解密会覆盖密文,提交前先取出下一块的初始向量
+            next_iv = bytes(chunk[-AES.block_size:]) if size >= AES.block_size else iv
+            pending.append(self.executor.submit(profiler.bind(self.decrypt_into), chunk, key, iv))
+            iv = next_iv
+            while pending and (pending[0].done() or len(pending) >= self.workers * 2):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    @property
+    def throughput(self):
+        """解密速度(字节/秒),按单个线程实际解密的耗时计算"""
+        return self.stats()['throughput']
+
+    def stats(self):
+        """
+        解密统计
+        @return: {'bytes': 解密字节数, 'busy_time': 解密耗时, 'throughput': 解密速度, 'workers': 线程数}
+        """
+        with self.lock:
+            return {
+                'bytes': self.bytes,
+                'busy_time': self.busy_time,
+                'throughput': self.bytes / self.busy_time if self.busy_time else 0.0,
+                'workers': self.workers,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.bytes = 0
+            self.busy_time = 0.0
+
+
+class StreamDecryptor:
+    """
+    流式 CBC 解密,用于边下载边解密
+    密文的前 16 字节为初始向量,之后每凑满 16 字节解密一次,不足的部分留到下一次
+    输出的明文始终是 16 字节的整数倍,末尾的 \\0 需要在全部写入后再去掉
+    """
+
+    def __init__(self, key, iv=None):
+        """
+        @param key: 秘钥
+        @param iv: 初始向量,为空时使用密文的前 16 字节
+        """
+        self.key = key
+        self.cipher = AES.new(key, AES.MODE_CBC, iv) if iv else None
+        self.buffer = bytearray()
+
+    def update(self, data):
+        """
+        解密一段密文
+        @param data: 密文
+        @return: 已经能解密的明文
+        """
+        self.buffer += data
+        if self.cipher is None:
+            if len(self.buffer) < AES.block_size:
+                return b''
+            self.cipher = AES.new(self.key, AES.MODE_CBC, bytes(self.buffer[:AES.block_size]))
+            del self.buffer[:AES.block_size]
+        size = len(self.buffer) - len(self.buffer) % AES.block_size
+        if not size:
+            return b''
+        plaintext = self.cipher.decrypt(memoryview(self.buffer)[:size])
+        del self.buffer[:size]
+        return plaintext
+
+    def finalize(self):
+        """检查密文是否完整"""
+        if self.buffer:
+            raise ValueError(f"密文长度不是 {AES.block_size} 的倍数")
+
+
+decrypt_pool = DecryptPool()
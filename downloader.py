@@ -1,11 +1,20 @@
+import asyncio
+import re
 from pathlib import Path
 
-import requests
-import datetime
 from Crypto.Cipher import AES
 import httpx
 
+from buffers import buffer_pool, read_chunks, reserve_space, preallocate
+from checkpoint import Checkpoint
+from client import client, create_async_client
+from decrypt_pool import decrypt_pool, StreamDecryptor
+from governor import governor
+from keystore import key_store
 from logger import logger
+from metrics import downloaded_bytes
+from ProgressBarUtils import DownloaderProgressBar
+from settings import RANGE_CONNECTIONS, RECEIVE_READ_SIZE
 from utils import ts2mp4
 
 
@@ -23,11 +32,34 @@ def decrypt(ciphertext, key):
 
 
 def decrypt_file(filename, key):
-    with open(filename, 'rb') as f:
-        ciphertext = f.read()
-    dec = decrypt(ciphertext, key)
-    with open(filename, 'wb') as f:
-        f.write(dec)
+    # 分块解密到临时文件再替换原文件,内存占用与文件大小无关
+    file = Path(filename)
+    tmp_file = file.with_name(f"{file.name}.dec")
+    with open(file, 'rb') as src, open(tmp_file, 'wb') as dst:
+        for chunk in decrypt_pool.decrypt_stream(src, key):
+            dst.write(chunk)
+    truncate_trailing_zeros(tmp_file)
+    tmp_file.replace(file)
+
+
+def truncate_trailing_zeros(filename, block_size=64 * 1024):
+    """
+    去掉文件末尾的 \\0,从文件末尾向前逐块查找,不读入整个文件
+    @param filename: 文件路径
+    @param block_size: 每次读取的大小
+    """
+    with open(filename, 'r+b') as f:
+        end = f.seek(0, 2)
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            block = f.read(end - start)
+            stripped = block.rstrip(b'\0')
+            if stripped:
+                end = start + len(stripped)
+                break
+            end = start
+        f.truncate(end)
 
 
 def get_key(filename):
@@ -37,7 +69,7 @@ def get_key(filename):
 
 
 def download(file_url, file):
-    res = requests.get(file_url)
+    res = client.get(file_url)
     with open(file, 'wb') as f:
         f.write(res.content)
     return 0
@@ -62,76 +94,247 @@ def progress(percent, width=30, filename=None):
 def lg_download(file_url, filename, path, headers=None):
     # 用来下载大文件，有进度条
     file = str(Path(path, filename))
-    response = requests.get(file_url, stream=True, headers=headers)
     size = 0
-    chunk_size = 1024
-    content_size = int(response.headers['content-length'])
-    if response.status_code == 200:
-        print(
-            '正在下载 {filename},大小: {size:.2f} MB'.format(
-                filename=filename, size=content_size / chunk_size / 1024
-            )
-        )
-
-        with open(file, 'wb') as f:
-            last_show_time = datetime.datetime.now()
-            delta_time = datetime.timedelta(seconds=1)
-            for data in response.iter_content(chunk_size=chunk_size):
+    with client.get(file_url, stream=True, headers=headers) as response:
+        if response.status_code != 200:
+            return
+        content_size = int(response.headers['content-length'])
+        # 复用同一个缓冲区接收,直接写入文件
+        buffer = buffer_pool.get(RECEIVE_READ_SIZE[1])
+        with open(file, 'wb') as f, DownloaderProgressBar(filename, content_size) as progress_bar:
+            reserve_space(f, content_size)
+            for data in read_chunks(response, buffer, governor.throttle):
                 f.write(data)
                 size += len(data)
-                if datetime.datetime.now() - last_show_time > delta_time:
-                    progress(size / content_size * 100, filename=filename)
-                    last_show_time = datetime.datetime.now()
+                progress_bar.addition(len(data))
+    buffer_pool.put(buffer)
+    downloaded_bytes.inc(size)
 
 
-async def async_download(url, path: Path, filename):
-    client = httpx.AsyncClient(
-        timeout=httpx.Timeout(10, connect=5, read=5, write=5, pool=5)
-    )
+def get_part_file(file: Path):
+    """
+    下载中的临时文件,下载完成后重命名为正式文件
+    @param file: 正式文件路径
+    @return: 临时文件路径
+    """
+    return file.with_name(f"{file.name}.part")
+
+
+def resume_headers(part_file: Path):
+    """
+    断点续传的请求头,临时文件存在时从临时文件末尾继续下载
+    @param part_file: 临时文件路径
+    @return: headers
+    """
+    if part_file.exists():
+        return {'Range': f'bytes={part_file.stat().st_size}-'}
+    return {}
+
+
+def resume_info(response, part_file: Path):
+    """
+    根据响应判断能否续传
+    服务器返回 206 时追加写入临时文件,否则从头开始下载
+    @param response: 响应
+    @param part_file: 临时文件路径
+    @return: 写入模式,已下载大小,文件总大小;临时文件已经完整时写入模式为 None
+    """
+    content_range = response.headers.get('content-range')
+    if response.status_code == 416:
+        # 临时文件已经下载完整,只是没来得及重命名,响应体是错误信息,不能写入
+        size = part_file.stat().st_size
+        return None, size, size
+    if response.status_code == 206 and content_range:
+        start, total = re.match(r'bytes (\d+)-\d*/(\d+)', content_range).groups()
+        if int(start) != part_file.stat().st_size:
+            raise IOError(f"{part_file} 续传位置错误: {content_range}")
+        return 'ab', int(start), int(total)
+    return 'wb', 0, int(response.headers['content-length'])
+
+
+async def async_download(url, path: Path, filename, key=None):
+    """
+    单连接下载,支持断点续传
+    @param url: 文件链接
+    @param path: 保存目录
+    @param filename: 文件名
+    @param key: 秘钥,不为空时边下载边解密,保存的是解密后的文件
+    @return:
+    """
     base_file = path.joinpath(filename)
-    size = 0
-    async with client.stream('GET', url) as response:
-        content_size = int(response.headers['content-length'])
-        if base_file.exists():
-            if base_file.stat().st_size == content_size:
-                return
-
-        with open(base_file, 'wb') as f:
-            current_size = 0
-            last_show_time = datetime.datetime.now()
-            delta_time = datetime.timedelta(seconds=1)
-            async for chunk in response.aiter_bytes(chunk_size=1024):
-                f.write(chunk)
+    part_file = get_part_file(base_file)
+    if base_file.exists():
+        return
+    async with create_async_client() as http_client, governor.arequest(url), \
+            http_client.stream('GET', url, headers=resume_headers(part_file)) as response:
+        mode, size, content_size = resume_info(response, part_file)
+        if mode is None:
+            part_file.replace(base_file)
+            logger.info('Download ' + filename)
+            return
+        # 临时文件中的明文总是 16 字节的整数倍,续传时从临时文件大小处开始请求,
+        # 第一块密文正好是接下来解密所需的初始向量
+        decryptor = StreamDecryptor(key) if key else None
+
+        with open(part_file, mode) as f, DownloaderProgressBar(filename, content_size) as progress_bar:
+            reserve_space(f, content_size)
+            progress_bar.addition(size)
+            start = size
+            # 不指定 chunk_size,按网络收到的大小处理,避免重新切分产生的拷贝
+            async for chunk in response.aiter_bytes():
+                await governor.athrottle(len(chunk))
+                f.write(decryptor.update(chunk) if decryptor else chunk)
                 size += len(chunk)
-                if size > current_size:
-                    current_size = max(size, current_size)
-                if datetime.datetime.now() - last_show_time > delta_time:
-                    progress(size / content_size * 100, filename=filename)
-                    last_show_time = datetime.datetime.now()
+                progress_bar.addition(len(chunk))
+        downloaded_bytes.inc(size - start)
+    if size != content_size:
+        raise IOError(f"{filename} 下载不完整,再次运行会继续下载")
+    if decryptor:
+        decryptor.finalize()
+        truncate_trailing_zeros(part_file)
+    part_file.replace(base_file)
+    logger.info('Download ' + filename)
+
+
+def split_range(total, parts, align=1):
+    """
+    将文件大小平均分成若干个字节范围
+    @param total: 文件大小
+    @param parts: 分段数
+    @param align: 每个范围的起点及大小对齐到 align 的整数倍,total 需要是 align 的整数倍
+    @return: [(start, end)] end 包含在范围内
+    """
+    if align > 1:
+        return [(start * align, (end + 1) * align - 1) for start, end in split_range(total // align, parts)]
+    parts = max(1, min(parts, total))
+    part_size = total // parts
+    ranges = []
+    for i in range(parts):
+        start = i * part_size
+        end = total - 1 if i == parts - 1 else start + part_size - 1
+        ranges.append((start, end))
+    return ranges
+
+
+async def range_download(url, path: Path, filename, connections=RANGE_CONNECTIONS, key=None):
+    """
+    多连接分段下载
+    将文件按字节范围分成 connections 段,并发下载写入预先分配好大小的文件中
+    服务器不支持 Range 时回退到单连接下载
+    已完成的分段记录在断点记录中,中断后再次下载只下载未完成的分段
+    @param url: 文件链接
+    @param path: 保存目录
+    @param filename: 文件名
+    @param connections: 连接数
+    @param key: 秘钥,不为空时每段边下载边解密,保存的是解密后的文件
+    @return:
+    """
+    base_file = path.joinpath(filename)
+    if base_file.exists():
+        return
+    # 探测服务器是否支持 Range
+    async with create_async_client(pool_size=connections) as http_client:
+        async with governor.arequest(url), http_client.stream('GET', url, headers={'Range': 'bytes=0-0'}) as response:
+            content_range = response.headers.get('content-range')
+            accept_range = response.status_code == 206 and content_range
+        if accept_range and connections > 1:
+            return await download_ranges(http_client, url, base_file, content_range, connections, key)
+    return await async_download(url, path, filename, key)
+
+
+async def download_ranges(http_client, url, base_file: Path, content_range, connections, key=None):
+    """
+    range_download 的多连接部分
+    @param http_client: httpx.AsyncClient
+    @param url: 文件链接
+    @param base_file: 保存文件路径
+    @param content_range: 探测请求响应的 content-range,用于获取文件大小
+    @param connections: 连接数
+    @param key: 秘钥,见 range_download
+    @return:
+    """
+    filename = base_file.name
+    content_size = int(content_range.rsplit('/', 1)[-1])
+    # 解密时按开头初始向量之后的密文分段并对齐到 16 字节,每段多请求前面 16 字节作为初始向量,
+    # 边下载边解密,明文写入该段在明文文件中的位置
+    iv_size = AES.block_size if key else 0
+    body_size = content_size - iv_size
+    if key and body_size % AES.block_size:
+        raise ValueError(f"密文长度不是 {AES.block_size} 的倍数")
+    ranges = split_range(body_size, connections, align=iv_size or 1)
+    part_file = base_file.with_name(f"{base_file.name}.ranges")
+    checkpoint = Checkpoint(base_file.with_name(f"{base_file.name}.json"),
+                            f"{content_size}/{len(ranges)}" + ('/decrypted' if key else ''))
+    if not checkpoint.segments or not part_file.exists():
+        checkpoint.segments.clear()
+        # 预先分配文件空间,各连接直接写入自己的位置
+        with open(part_file, 'wb') as f:
+            preallocate(f, body_size)
+
+    progress_bar = DownloaderProgressBar(filename, body_size + iv_size * len(ranges))
+    progress_bar.addition(sum(checkpoint.segments.values()))
+
+    async def fetch_range(index, start, end):
+        headers = {'Range': f'bytes={start}-{end + iv_size}'}
+        decryptor = StreamDecryptor(key) if key else None
+        async with governor.arequest(url), http_client.stream('GET', url, headers=headers) as res:
+            if res.status_code != 206:
+                raise httpx.HTTPStatusError(f"Range 请求失败: {res.status_code}", request=res.request, response=res)
+            with open(part_file, 'r+b') as f:
+                f.seek(start)
+                size = 0
+                async for chunk in res.aiter_bytes():
+                    await governor.athrottle(len(chunk))
+                    f.write(decryptor.update(chunk) if decryptor else chunk)
+                    size += len(chunk)
+                    progress_bar.addition(len(chunk))
+        if size != end - start + 1 + iv_size:
+            raise IOError(f"{filename} 分段 {start}-{end} 下载不完整")
+        if decryptor:
+            decryptor.finalize()
+        downloaded_bytes.inc(size)
+        checkpoint.done(index, size)
+
+    try:
+        await asyncio.gather(*(
+            fetch_range(index, start, end)
+            for index, (start, end) in enumerate(ranges)
+            if not checkpoint.is_done(index)
+        ))
+    finally:
+        checkpoint.flush()
+        progress_bar.close()
+    if key:
+        truncate_trailing_zeros(part_file)
+    part_file.replace(base_file)
+    checkpoint.remove()
     logger.info('Download ' + filename)
-    await client.aclose()
 
 
 def _download(url, path: Path, filename):
-    client = httpx.Client(timeout=httpx.Timeout(10, connect=5, read=5, write=5, pool=5))
     filename_ext = filename + '.ts'
     base_file = path.joinpath(filename_ext)
-    size = 0
-    with client.stream('GET', url) as response:
-        content_size = int(response.headers['content-length'])
-        if base_file.exists() and base_file.stat().st_size == content_size:
+    part_file = get_part_file(base_file)
+    if base_file.exists():
+        return
+    with client.get(url, stream=True, headers=resume_headers(part_file)) as response:
+        mode, size, content_size = resume_info(response, part_file)
+        if mode is None:
+            part_file.replace(base_file)
             return
-        with open(base_file, 'wb') as f:
-            current_size = 0
-            last_show_time = datetime.datetime.now()
-            delta_time = datetime.timedelta(seconds=1)
-            for chunk in response.iter_bytes():
-                f.write(chunk)
-                size += len(chunk)
-                current_size = size
-                if datetime.datetime.now() - last_show_time > delta_time:
-                    progress(current_size / content_size * 100, filename=filename)
-                    last_show_time = datetime.datetime.now()
+        buffer = buffer_pool.get(RECEIVE_READ_SIZE[1])
+        with open(part_file, mode) as f, DownloaderProgressBar(filename, content_size) as progress_bar:
+            progress_bar.addition(size)
+            start = size
+            for data in read_chunks(response, buffer, governor.throttle):
+                f.write(data)
+                size += len(data)
+                progress_bar.addition(len(data))
+        buffer_pool.put(buffer)
+        downloaded_bytes.inc(size - start)
+    if size != content_size:
+        raise IOError(f"{filename} 下载不完整,再次运行会继续下载")
+    part_file.replace(base_file)
 
 
 async def download_single(ts_url, key_url, filename, path):
@@ -139,21 +342,16 @@ async def download_single(ts_url, key_url, filename, path):
     # 处理路径
     filename = filename.replace('/', '／').replace('\\', '＼')
     ts_file: Path = path.joinpath(f"{filename}.ts")
-    key_file = path.joinpath("key")
     video_file = path.joinpath(f"{ts_file.stem}.mp4")
     # 判断是否下载过
     if video_file.exists():
         print(f"{video_file} 已存在！")
         return
-    # 下载视频
-    await async_download(ts_url, path, ts_file.name)
-    # _download(ts_url, path, filename)
-    # 下载秘钥
-    download(file_url=key_url, file=key_file)
-    # 解密文件
-    key = get_key(key_file)
-    decrypt_file(ts_file, key)
-    key_file.unlink()
+    # 获取秘钥
+    key = await asyncio.get_running_loop().run_in_executor(None, key_store.get, key_url)
+    # 下载视频,同时解密
+    await range_download(ts_url, path, ts_file.name, key=key)
+    # await async_download(ts_url, path, ts_file.name, key)
     # 合成 MP4
     ts2mp4(ts_file)
     print(f"\n{filename} 下载完成！")
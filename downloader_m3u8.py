@@ -1,18 +1,14 @@
 import os
-import requests
 from pathlib import Path
+
+from client import client
 from downloader import ts2mp4, progress
+from hls import load_playlist
 
 
 def get_m3u8_body(url):
     print('read m3u8 file:', url)
-    with requests.Session() as session:
-        adapter = requests.adapters.HTTPAdapter(
-            pool_connections=10, pool_maxsize=10, max_retries=10
-        )
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        r = session.get(url, timeout=10)
+    r = client.get(url, timeout=10)
     return r.text
 
 
@@ -33,7 +29,7 @@ def _download_ts_file(ts_url_list, file):
     total = len(ts_url_list)
     for ts_url in ts_url_list:
         i += 1
-        r = requests.get(ts_url)
+        r = client.get(ts_url)
         with open(file, 'ab') as f:
             f.write(r.content)
         progress(i / total * 100)
@@ -48,15 +44,11 @@ def _check_dir(path):
 
 
 def get_download_url_list(host, m3u8_url, url_list=None):
+    # 主播放列表只选择一个清晰度,相对路径相对于 m3u8_url 拼接,不再需要 host
     if url_list is None:
         url_list = []
-    body = get_m3u8_body(m3u8_url)
-    ts_url_list = get_url_list(host, body)
-    for url in ts_url_list:
-        if url.lower().endswith('.m3u8'):
-            url_list = get_download_url_list(host, url, url_list)
-        else:
-            url_list.append(url)
+    playlist = load_playlist(m3u8_url)
+    url_list.extend(segment.uri for segment in playlist.segments)
     return url_list
 
 
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from contextlib import contextmanager, asynccontextmanager
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlparse
+
+from settings import MAX_BYTES_PER_SECOND, HOST_LIMITS, DEFAULT_HOST_LIMIT
+
+
+class TokenBucket:
+    """
+    令牌桶
+    令牌以 rate 的速度增加,最多积攒 capacity 个;令牌不足时允许透支,透支的部分需要等待补足
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        @param rate: 每秒增加的令牌数,为空时不限制
+        @param capacity: 令牌桶容量(允许的突发量),默认为一秒的令牌数
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.update_time = time.monotonic()
+        self.lock = Lock()
+
+    def reserve(self, amount):
+        """
+        取出令牌
+        @param amount: 令牌数
+        @return: 需要等待的时间(秒)
+        """
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.update_time) * self.rate)
+            self.update_time = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def consume(self, amount):
+        """取出令牌,不足时阻塞等待"""
+        wait = self.reserve(amount)
+        if wait:
+            time.sleep(wait)
+
+    async def aconsume(self, amount):
+        """取出令牌,不足时异步等待"""
+        wait = self.reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class Governor:
+    """
+    全局流量控制
+    所有下载共用一个总带宽令牌桶,每个 host 单独限制同时连接数和每秒请求数
+    """
+
+    def __init__(self, bytes_per_second=MAX_BYTES_PER_SECOND, host_limits=None, default_host_limit=None):
+        """
+        @param bytes_per_second: 总带宽上限(字节/秒),为空时不限制
+        @param host_limits: 每个 host 的限制 {host: {'connections': 同时连接数, 'rps': 每秒请求数}}
+        @param default_host_limit: 没有单独设置的 host 使用的限制
+        """
+        self.bandwidth = TokenBucket(bytes_per_second)
+        self.host_limits = HOST_LIMITS if host_limits is None else host_limits
+        self.default_host_limit = DEFAULT_HOST_LIMIT if default_host_limit is None else default_host_limit
+        self.lock = Lock()
+        self.semaphores = {}
+        self.async_semaphores = {}
+        self.buckets = {}
+
+    def get_limit(self, host):
+        return self.host_limits.get(host, self.default_host_limit)
+
+    def get_bucket(self, host):
+        """每个 host 的请求数令牌桶"""
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.get_limit(host).get('rps'))
+            return bucket
+
+    def get_semaphore(self, host):
+        """每个 host 的连接数信号量,不限制时为 None"""
+        connections = self.get_limit(host).get('connections')
+        if not connections:
+            return None
+        with self.lock:
+            semaphore = self.semaphores.get(host)
+            if semaphore is None:
+                semaphore = self.semaphores[host] = BoundedSemaphore(connections)
+            return semaphore
+
+    def get_async_semaphore(self, host):
+        """每个事件循环、每个 host 的连接数信号量,不限制时为 None"""
+        connections = self.get_limit(host).get('connections')
+        if not connections:
+            return None
+        key = (asyncio.get_running_loop(), host)
+        with self.lock:
+            semaphore = self.async_semaphores.get(key)
+            if semaphore is None:
+                semaphore = self.async_semaphores[key] = asyncio.Semaphore(connections)
+            return semaphore
+
+    @contextmanager
+    def request(self, url):
+        """
+        发起请求前获取 host 的连接数及请求数许可
+        @param url: 请求链接
+        """
+        host = urlparse(url).hostname
+        semaphore = self.get_semaphore(host)
+        if semaphore:
+            semaphore.acquire()
+        try:
+            self.get_bucket(host).consume(1)
+            yield
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    @asynccontextmanager
+    async def arequest(self, url):
+        """request 的异步版本"""
+        host = urlparse(url).hostname
+        semaphore = self.get_async_semaphore(host)
+        if semaphore:
+            await semaphore.acquire()
+        try:
+            await self.get_bucket(host).aconsume(1)
+            yield
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    def throttle(self, size):
+        """
+        记录下载的字节数,超过总带宽时阻塞等待
+        @param size: 字节数
+        """
+        self.bandwidth.consume(size)
+
+    async def athrottle(self, size):
+        """throttle 的异步版本"""
+        await self.bandwidth.aconsume(size)
+
+
+governor = Governor()
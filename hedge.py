@@ -0,0 +1,205 @@
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from threading import Event, Lock, local
+
+from logger import logger
+from metrics import retries, hedged_requests
+from profiler import profiler
+from settings import HEDGE_PERCENTILE, SEGMENT_RETRIES, SEGMENT_TIMEOUT, RETRY_BACKOFF, MAX_SEGMENT_REQUESTS
+
+
+class LatencyTracker:
+    """
+    请求延迟统计
+    保存最近 size 次成功请求的耗时,用于计算分位延迟
+    """
+
+    def __init__(self, size=200, min_samples=20):
+        """
+        @param size: 保存的样本数
+        @param min_samples: 样本数少于该值时不计算分位延迟
+        """
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p):
+        """
+        @param p: 分位,0 ~ 1
+        @return: 分位延迟(秒),样本不足时返回 None
+        """
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+class HedgeCancelled(Exception):
+    """另一个相同的请求已经成功,当前请求被取消"""
+
+
+def backoff(attempt, base=RETRY_BACKOFF[0], cap=RETRY_BACKOFF[1]):
+    """
+    重试前的等待时间,指数增长并在 [0, 上限] 内随机抖动,避免大量请求同时重试
+    @param attempt: 已失败的次数,从 0 开始
+    @return: 等待时间(秒)
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Hedger:
+    """
+    对冲请求
+    请求超过分位延迟仍未完成时发起一个相同的请求,先成功的结果生效;
+    失败后按抖动退避重试。较慢的请求被标记为取消,请求函数通过 cancelled() 检查后中止,
+    已经完成的结果交给 discard 回收
+    请求函数在真正发出请求时(例如拿到并发名额之后)进入 measure(),
+    延迟样本和对冲等待都从这里开始计时,排队的时间不计入
+    """
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, retries=SEGMENT_RETRIES, timeout=SEGMENT_TIMEOUT,
+                 workers=MAX_SEGMENT_REQUESTS * 2):
+        """
+        @param percentile: 发起重复请求的延迟分位
+        @param retries: 失败后的重试次数
+        @param timeout: 单次请求总时限的 (下限, 上限)
+        @param workers: 执行请求的线程数,每个请求最多占用两个线程
+        """
+        self.tracker = LatencyTracker()
+        self.percentile = percentile
+        self.retries = retries
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hedge')
+        self.hedges = 0
+        self.local = local()
+
+    def deadline(self):
+        """
+        单次请求的总时限,为 p99 延迟的 4 倍,限制在 timeout 范围内;样本不足时使用上限
+        @return: 时限(秒)
+        """
+        low, high = self.timeout
+        p99 = self.tracker.percentile(0.99)
+        if p99 is None:
+            return high
+        return min(high, max(low, p99 * 4))
+
+    @contextmanager
+    def measure(self):
+        """
+        标记请求开始,正常结束时记录耗时
+        @return: 开始时间(time.monotonic)
+        """
+        started = getattr(self.local, 'started', None)
+        if started:
+            started.set()
+        start = time.monotonic()
+        yield start
+        self.tracker.add(time.monotonic() - start)
+
+    def cancelled(self):
+        """
+        当前线程执行的请求是否已被取消(另一个相同的请求先成功)
+        @return: bool
+        """
+        cancelled = getattr(self.local, 'cancelled', None)
+        return cancelled is not None and cancelled.is_set()
+
+    def run(self, started, cancelled, func, *args):
+        """执行请求,请求进入 measure() 或结束时设置 started,取消时设置 cancelled"""
+        self.local.started = started
+        self.local.cancelled = cancelled
+        try:
+            return func(*args)
+        finally:
+            self.local.started = None
+            self.local.cancelled = None
+            started.set()
+
+    def submit(self, started, func, *args):
+        """
+        在线程池中执行请求
+        @return: (Future, 取消请求的 Event)
+        """
+        cancelled = Event()
+        return self.executor.submit(profiler.bind(self.run), started, cancelled, func, *args), cancelled
+
+    @staticmethod
+    def abandon(attempts, winner, discard=None):
+        """
+        取消 winner 以外的请求,之后成功完成的结果交给 discard
+        @param attempts: {Future: 取消请求的 Event}
+        @param winner: 生效的 Future
+        @param discard: 回收结果的函数
+        """
+        def on_done(future):
+            if not future.cancelled() and future.exception() is None:
+                discard(future.result())
+
+        for future, cancelled in attempts.items():
+            if future is winner:
+                continue
+            cancelled.set()
+            if not future.cancel() and discard:
+                future.add_done_callback(on_done)
+
+    def call_once(self, func, *args, discard=None):
+        """
+        执行一次请求,开始后超过分位延迟仍未完成时发起重复请求
+        @param discard: 回收未生效请求结果的函数
+        @return: 先成功的请求结果,都失败时抛出第一个请求的异常
+        """
+        delay = self.tracker.percentile(self.percentile)
+        if delay is None:
+            return self.run(Event(), None, func, *args)
+
+        started = Event()
+        primary, cancelled = self.submit(started, func, *args)
+        started.wait()
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        hedged_requests.inc()
+        hedge, hedge_cancelled = self.submit(Event(), func, *args)
+        attempts = {primary: cancelled, hedge: hedge_cancelled}
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.abandon(attempts, future, discard)
+                    return future.result()
+        return primary.result()
+
+    def call(self, func, *args, errors=(Exception,), discard=None):
+        """
+        执行请求,失败时重试
+        @param func: 请求函数,最后一个参数为请求总时限,从进入 measure() 时开始计算
+        @param args: 请求函数的其他参数
+        @param errors: 需要重试的异常类型
+        @param discard: 回收未生效请求结果的函数,例如把缓冲区放回缓冲池
+        @return: 请求结果
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self.call_once(func, *args, self.deadline(), discard=discard)
+            except errors as e:
+                if attempt >= self.retries:
+                    raise
+                wait_time = backoff(attempt)
+                retries.inc()
+                logger.warning(f"请求失败,{wait_time:.1f} 秒后重试({attempt + 1}/{self.retries}): {e}")
+                time.sleep(wait_time)
+
+
+hedger = Hedger()
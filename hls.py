@@ -0,0 +1,228 @@
+import re
+import time
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import List, Optional, Tuple
+from urllib.parse import urljoin
+
+from client import client
+from profiler import profiler
+from settings import PLAYLIST_TTL, MAX_BANDWIDTH
+from utils import get_url_expire
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(text: str) -> dict:
+    """
+    解析标签属性列表,如 METHOD=AES-128,URI="..."
+    @param text: 属性列表文本
+    @return: {属性名: 属性值},属性值去掉引号
+    """
+    return {name: value.strip('"') for name, value in ATTRIBUTE_PATTERN.findall(text)}
+
+
+@dataclass
+class Key:
+    """#EXT-X-KEY"""
+    method: str
+    uri: Optional[str] = None
+    iv: Optional[bytes] = None
+
+
+@dataclass
+class Segment:
+    """媒体分段"""
+    uri: str
+    duration: float
+    sequence: int
+    key: Optional[Key] = None
+    # (长度, 起始位置),来自 #EXT-X-BYTERANGE
+    byte_range: Optional[Tuple[int, int]] = None
+
+    @property
+    def iv(self) -> Optional[bytes]:
+        """
+        解密使用的初始向量
+        #EXT-X-KEY 没有指定 IV 时,使用分段序号的 16 字节大端表示
+        """
+        if self.key is None or self.key.method == 'NONE':
+            return None
+        return self.key.iv or self.sequence.to_bytes(16, 'big')
+
+
+@dataclass
+class Variant:
+    """主播放列表中的一个清晰度"""
+    uri: str
+    bandwidth: int = 0
+    resolution: Optional[Tuple[int, int]] = None
+    codecs: Optional[str] = None
+
+
+@dataclass
+class Playlist:
+    """m3u8 播放列表"""
+    url: str
+    variants: List[Variant] = field(default_factory=list)
+    segments: List[Segment] = field(default_factory=list)
+    target_duration: Optional[float] = None
+    media_sequence: int = 0
+    end_list: bool = False
+
+    @property
+    def is_master(self) -> bool:
+        return bool(self.variants)
+
+    @property
+    def duration(self) -> float:
+        return sum(segment.duration for segment in self.segments)
+
+    @property
+    def key_url(self) -> Optional[str]:
+        """第一个加密分段的秘钥链接"""
+        for segment in self.segments:
+            if segment.key and segment.key.uri:
+                return segment.key.uri
+        return None
+
+
+def parse_playlist(content: str, url: str, join_url: bool = True) -> Playlist:
+    """
+    解析 m3u8 文件
+    @param content: m3u8 文件内容
+    @param url: m3u8 文件链接,拼接相对路径时使用
+    @param join_url: 是否将分段及清晰度链接拼接为完整路径
+    @return: Playlist
+    """
+    if "#EXTM3U" not in content:
+        raise Exception("非 m3u8 的链接")
+
+    playlist = Playlist(url)
+    key = None
+    duration = 0.0
+    byte_range = None
+    next_offset = 0
+    variant = None
+    sequence = 0
+
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            tag, _, value = line.partition(':')
+            if tag == '#EXT-X-MEDIA-SEQUENCE':
+                playlist.media_sequence = sequence = int(value)
+            elif tag == '#EXT-X-TARGETDURATION':
+                playlist.target_duration = float(value)
+            elif tag == '#EXT-X-ENDLIST':
+                playlist.end_list = True
+            elif tag == '#EXT-X-KEY':
+                attributes = parse_attributes(value)
+                iv = attributes.get('IV')
+                key = Key(
+                    method=attributes.get('METHOD'),
+                    uri=attributes.get('URI'),
+                    iv=bytes.fromhex(iv[2:]) if iv else None,
+                )
+            elif tag == '#EXTINF':
+                duration = float(value.split(',')[0])
+            elif tag == '#EXT-X-BYTERANGE':
+                length, _, offset = value.partition('@')
+                offset = int(offset) if offset else next_offset
+                byte_range = (int(length), offset)
+                next_offset = offset + int(length)
+            elif tag == '#EXT-X-STREAM-INF':
+                attributes = parse_attributes(value)
+                resolution = attributes.get('RESOLUTION')
+                variant = Variant(
+                    uri='',
+                    bandwidth=int(attributes.get('BANDWIDTH', 0)),
+                    resolution=tuple(map(int, resolution.split('x'))) if resolution else None,
+                    codecs=attributes.get('CODECS'),
+                )
+            continue
+
+        uri = urljoin(url, line) if join_url else line
+        if variant is not None:
+            variant.uri = uri
+            playlist.variants.append(variant)
+            variant = None
+        else:
+            playlist.segments.append(Segment(uri, duration, sequence, key, byte_range))
+            sequence += 1
+            duration = 0.0
+            byte_range = None
+    return playlist
+
+
+def choose_variant(playlist: Playlist, max_bandwidth: Optional[int] = MAX_BANDWIDTH) -> Variant:
+    """
+    选择清晰度
+    @param playlist: 主播放列表
+    @param max_bandwidth: 码率上限,为空时选择码率最高的,都超过上限时选择码率最低的
+    @return: Variant
+    """
+    variants = sorted(playlist.variants, key=lambda v: v.bandwidth, reverse=True)
+    if max_bandwidth is None:
+        return variants[0]
+    for variant in variants:
+        if variant.bandwidth <= max_bandwidth:
+            return variant
+    return variants[-1]
+
+
+class PlaylistCache:
+    """
+    播放列表缓存
+    按链接缓存解析后的播放列表,链接带有签名时在签名过期后失效
+    """
+
+    def __init__(self, ttl=PLAYLIST_TTL):
+        """
+        @param ttl: 缓存时间(秒)
+        """
+        self.ttl = ttl
+        self.playlists = {}
+        self.lock = Lock()
+
+    def get(self, url):
+        with self.lock:
+            cached = self.playlists.get(url)
+            if cached and cached[1] > time.time():
+                return cached[0]
+            self.playlists.pop(url, None)
+            return None
+
+    def set(self, url, playlist):
+        expire = time.time() + self.ttl
+        url_expire = get_url_expire(url)
+        if url_expire:
+            expire = min(expire, url_expire)
+        with self.lock:
+            self.playlists[url] = (playlist, expire)
+
+
+playlist_cache = PlaylistCache()
+
+
+def load_playlist(url: str, content: str = None, max_bandwidth: Optional[int] = MAX_BANDWIDTH) -> Playlist:
+    """
+    获取并解析媒体播放列表
+    主播放列表只请求选中的一个清晰度
+    @param url: m3u8 文件链接
+    @param content: m3u8 文件内容,存在内容时不会再请求链接
+    @param max_bandwidth: 码率上限,见 choose_variant
+    @return: 媒体播放列表
+    """
+    playlist = playlist_cache.get(url) if content is None else None
+    if playlist is None:
+        with profiler.phase('playlist'):
+            if content is None:
+                content = client.get(url, timeout=10).text
+            playlist = parse_playlist(content, url)
+        playlist_cache.set(url, playlist)
+    if playlist.is_master:
+        return load_playlist(choose_variant(playlist, max_bandwidth).uri, max_bandwidth=max_bandwidth)
+    return playlist
@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from client import client
+from metrics import key_fetch_seconds
+from profiler import profiler
+from settings import KEY_TTL
+from utils import get_url_expire
+
+
+class KeyStore:
+    """
+    AES 秘钥缓存
+    同一个 key_url 同时只会有一个请求,其他调用者等待同一个结果
+    获取到的秘钥在有效期内保存在内存中。后续视频的秘钥由 scheduler.MetadataPrefetcher
+    在解析元数据时一并获取
+    """
+
+    def __init__(self, ttl=KEY_TTL, workers=2):
+        """
+        @param ttl: 秘钥缓存时间(秒),key_url 带有签名过期时间时取较早者
+        @param workers: 请求秘钥的线程数
+        """
+        self.ttl = ttl
+        self.keys = {}
+        self.pending = {}
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='keystore')
+
+    @staticmethod
+    def fetch(key_url):
+        """
+        请求秘钥
+        @param key_url: 秘钥链接
+        @return: 秘钥
+        """
+        with key_fetch_seconds.time(), profiler.phase('key'):
+            response = client.get(key_url)
+        response.raise_for_status()
+        return response.content
+
+    def load(self, key_url):
+        """请求秘钥并保存到缓存中"""
+        try:
+            key = self.fetch(key_url)
+            expire = time.time() + self.ttl
+            url_expire = get_url_expire(key_url)
+            if url_expire:
+                expire = min(expire, url_expire)
+            with self.lock:
+                self.keys[key_url] = (key, expire)
+            return key
+        finally:
+            with self.lock:
+                self.pending.pop(key_url, None)
+
+    def get_cached(self, key_url):
+        """
+        读取缓存的秘钥
+        @param key_url: 秘钥链接
+        @return: 秘钥,没有缓存或已过期时返回 None
+        """
+        cached = self.keys.get(key_url)
+        if cached and cached[1] > time.time():
+            return cached[0]
+        return None
+
+    def submit(self, key_url):
+        """
+        获取秘钥的 Future,已有相同 key_url 的请求时复用该请求
+        @param key_url: 秘钥链接
+        @return: Future
+        """
+        with self.lock:
+            future = self.pending.get(key_url)
+            if future is None:
+                future = self.executor.submit(self.load, key_url)
+                self.pending[key_url] = future
+            return future
+
+    def get(self, key_url):
+        """
+        获取秘钥
+        @param key_url: 秘钥链接
+        @return: 秘钥
+        """
+        key = self.get_cached(key_url)
+        if key is not None:
+            return key
+        return self.submit(key_url).result()
+
+
+key_store = KeyStore()
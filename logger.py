@@ -1,3 +1,10 @@
 import logging
 
+from settings import LOG_LEVEL, LOG_FILE
+
 logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+if not logger.handlers:
+    handler = logging.FileHandler(LOG_FILE, encoding='utf-8') if LOG_FILE else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(threadName)s] %(message)s'))
+    logger.addHandler(handler)
@@ -1,10 +1,35 @@
+import mmap
+import os
 import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from subprocess import Popen, DEVNULL
+from subprocess import Popen, DEVNULL, PIPE
+from tempfile import TemporaryFile
+from threading import BoundedSemaphore
 from urllib.parse import urljoin
 
-import requests
-from Crypto.Cipher import AES
+from requests import RequestException
+from requests.exceptions import Timeout
+
+from buffers import buffer_pool, receive, reserve_space, preallocate
+from checkpoint import Checkpoint, BitmapCheckpoint, playlist_fingerprint
+from client import client, segment_client
+from decrypt_pool import decrypt_pool
+from governor import governor
+from hedge import hedger, HedgeCancelled
+from hls import load_playlist, parse_playlist
+from metrics import segment_seconds, segment_bytes, downloaded_bytes, merge_seconds
+from profiler import profiler
+from quality import throughput_meter
+from settings import MAX_SEGMENT_REQUESTS, DECRYPT_WINDOW, HTTP_TIMEOUT
+from utils import get_ts_range
+
+# 限制所有下载同时进行的 ts 请求数
+segment_semaphore = BoundedSemaphore(MAX_SEGMENT_REQUESTS)
+# #EXT-X-KEY 中的 URI 属性
+KEY_URI_PATTERN = re.compile(r'URI="(.*?)"')
 
 
 def get_m3u8_content(url):
@@ -13,7 +38,7 @@ def get_m3u8_content(url):
     @param url: m3u8 文件链接
     @return: m3u8 文件内容
     """
-    with requests.get(url, timeout=10) as response:
+    with client.get(url, timeout=10) as response:
         return response.text
 
 
@@ -25,62 +50,375 @@ def parse_m3u8(url: str, content: str = None, join_ts_url: bool = True):
     @param join_ts_url: 拼接 ts_url 完整路径
     @return: key_url,ts_urls
     """
-    if content is None:
-        content = get_m3u8_content(url)
-
-    # 判断是否是 m3u8 文件
-    if "#EXTM3U" not in content:
-        raise Exception("非 m3u8 的链接")
-
-    # 判断是否还有其他 m3u8 链接
-    if "EXT-X-STREAM-INF" in content:
-        file_line = content.splitlines()
-        for line in file_line:
-            if '.m3u8' in line:
-                url = urljoin(url, line)
-                content = get_m3u8_content(url)
-
-    # 解析 key_url
-    method, key_url = re.compile('#EXT-X-KEY:METHOD=(.*?),URI="(.*?)"').findall(content)[0]
-    # 解析 ts_urls
-    ts_urls = re.compile(".*\\.ts\\?.*").findall(content)
-    # 拼接 ts_url 完整路径
     if join_ts_url:
-        ts_urls = [urljoin(url, ts_url) for ts_url in ts_urls]
-    return key_url, ts_urls
+        # 主播放列表会选择一个清晰度继续解析
+        playlist = load_playlist(url, content)
+    else:
+        # 保留文件中的原始路径
+        if content is None:
+            content = get_m3u8_content(url)
+        playlist = parse_playlist(content, url, join_url=False)
+    return playlist.key_url, [segment.uri for segment in playlist.segments]
+
+
+def parse_m3u8_segments(url: str, content: str = None):
+    """
+    解析 m3u8 文件中的 key_url,ts_urls 及每个 ts 文件解密使用的初始向量
+    @param url: m3u8 文件链接
+    @param content: m3u8 文件内容,存在内容时不会再请求链接
+    @return: key_url,ts_urls,ivs
+    """
+    playlist = load_playlist(url, content)
+    segments = playlist.segments
+    return playlist.key_url, [segment.uri for segment in segments], [segment.iv for segment in segments]
+
+
+def request_ts(ts_url, timeout):
+    """
+    请求单个 ts 文件
+    内容直接读入缓冲池中的缓冲区,大小未知时使用链接中的 start,end 参数预估
+    重试由 hedger 负责,这里使用不重试的 segment_client
+    @param ts_url: ts 文件链接
+    @param timeout: 请求总时限(秒),超过时抛出 Timeout
+    @return: (ts 文件内容的 memoryview, 耗时),内容写入后通过 buffer_pool.put 放回
+    """
+    ts_range = get_ts_range(ts_url)
+
+    def on_chunk(size):
+        governor.throttle(size)
+        if hedger.cancelled():
+            raise HedgeCancelled(f"重复请求已完成,取消下载: {ts_url}")
+        if time.monotonic() > deadline:
+            raise Timeout(f"ts 文件下载超时({timeout:.1f} 秒): {ts_url}")
+
+    # 拿到并发名额后才开始计时,排队的时间不计入延迟和时限
+    with segment_semaphore, hedger.measure() as start, profiler.phase('segment'), \
+            segment_client.get(ts_url, stream=True, timeout=(HTTP_TIMEOUT[0], timeout)) as res:
+        deadline = start + timeout
+        res.raise_for_status()
+        content = receive(res, ts_range and ts_range[1] - ts_range[0] + 1, on_chunk)
+    return content, time.monotonic() - start
+
+
+def fetch_ts(ts_url):
+    """
+    下载单个 ts 文件
+    请求总时限根据最近的延迟调整,超过 p95 延迟时发起重复请求,失败后退避重试
+    只统计生效请求的流量和耗时,被取消的请求读到的内容直接放回缓冲池
+    @param ts_url: ts 文件链接
+    @return: ts 文件内容的 memoryview,见 request_ts
+    """
+    content, seconds = hedger.call(request_ts, ts_url, errors=(RequestException,),
+                                   discard=lambda result: buffer_pool.put(result[0]))
+    throughput_meter.add(len(content))
+    segment_seconds.observe(seconds)
+    segment_bytes.observe(len(content))
+    downloaded_bytes.inc(len(content))
+    return content
+
+
+def fetch_ts_ordered(tasks, workers=1):
+    """
+    并发下载 ts 文件,按照列表顺序返回
+    同时下载的数量不超过 workers 的两倍,避免下载过快时内存中积压过多的 ts 文件
+    @param tasks: (索引, ts 文件链接) 列表
+    @param workers: 并发下载数
+    @return: 生成器,按顺序产生 (索引, ts 文件内容)
+    """
+    if workers <= 1:
+        for i, ts_url in tasks:
+            yield i, fetch_ts(ts_url)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tasks = iter(tasks)
+        pending = deque()
 
+        def submit_next():
+            task = next(tasks, None)
+            if task is not None:
+                i, ts_url = task
+                pending.append((i, executor.submit(profiler.bind(fetch_ts), ts_url)))
 
-def download_ts_split(ts_urls, key, output_dir: Path, progress_bar):
+        for _ in range(workers * 2):
+            submit_next()
+        while pending:
+            i, future = pending.popleft()
+            content = future.result()
+            # 取走一个再补充一个
+            submit_next()
+            yield i, content
+
+
+def decrypt_ordered(segments, key, ivs=None, window=DECRYPT_WINDOW):
+    """
+    将按顺序下载的 ts 文件交给解密线程池解密,按原顺序返回
+    @param segments: 按顺序产生 (索引, ts 文件内容) 的可迭代对象
+    @param key: 秘钥,为空时不解密
+    @param ivs: 每个 ts 文件的初始向量,为空时使用 key
+    @param window: 同时解密的 ts 文件数上限
+    @return: 生成器,按顺序产生 (索引, 解密后的内容)
+    """
+    if not key:
+        yield from segments
+        return
+
+    pending = deque()
+    for i, content in segments:
+        pending.append(decrypt_pool.submit(i, content, key, ivs[i] if ivs else None))
+        # 已经解密完成的先写入,同时避免积压过多
+        while pending and (pending[0].done() or len(pending) >= window):
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def download_ts_split(ts_urls, key, output_dir: Path, progress_bar, workers: int = 1, checkpoint=None, ivs=None):
     """
     下载 m3u8 ts 文件列表
     @param ts_urls: ts 文件列表
     @param key: 解密文件,没有不进行解密
     @param output_dir: 保存目录
-    @return: 下载的 ts 路径列表
     @param progress_bar: 下载进度条
+    @param workers: 并发下载数,ts 文件乱序下载,但按顺序解密写入
+    @param checkpoint: 断点记录,已完成的 ts 文件不再下载
+    @param ivs: 每个 ts 文件的初始向量,为空时使用 key
+    @return: 下载的 ts 路径列表
     """
-    output_files = []
-
-    if key:
-        # 解密器
-        decryptor = AES.new(key, AES.MODE_CBC, key)
+    output_files = [output_dir.joinpath(f"{i}.ts").resolve() for i in range(len(ts_urls))]
 
+    tasks = []
     for i, ts_url in enumerate(ts_urls):
-        res = requests.get(ts_url)
-        progress_bar.addition(len(res.content))
-        output_path = output_dir.joinpath(f"{i}.ts")
-        output_files.append(output_path.resolve())
-
-        # # AES 解密
-        if key:
-            output_path.write_bytes(decryptor.decrypt(res.content))
+        if checkpoint and checkpoint.is_done(i, output_files[i]):
+            progress_bar.addition(output_files[i].stat().st_size)
         else:
-            output_path.write_bytes(res.content)
+            tasks.append((i, ts_url))
+
+    # 下载与解密同时进行,按顺序写入
+    try:
+        for i, content in decrypt_ordered(fetch_ts_ordered(tasks, workers), key, ivs):
+            progress_bar.addition(len(content))
+            with profiler.phase('write'):
+                output_files[i].write_bytes(content)
+            buffer_pool.put(content)
+            if checkpoint:
+                checkpoint.done(i, len(content))
+    finally:
+        if checkpoint:
+            checkpoint.flush()
 
     return output_files
 
 
-def download_m3u8(m3u8_url, output_path: Path, handle_key_url=None, handle_ts_url=None, headers: str = None):
+def download_ts_stream(ts_urls, key, output, progress_bar, workers: int = 1, checkpoint=None, ivs=None):
+    """
+    下载 m3u8 ts 文件列表,解密后按顺序直接写入同一个输出流,不产生 ts 碎片文件
+    @param ts_urls: ts 文件列表
+    @param key: 解密文件,没有不进行解密
+    @param output: 可写的二进制文件对象,如打开的文件或 ffmpeg 的 stdin
+    @param progress_bar: 下载进度条
+    @param workers: 并发下载数
+    @param checkpoint: 断点记录,输出流中已写入的 ts 文件不再下载
+    @param ivs: 每个 ts 文件的初始向量,为空时使用 key
+    @return: 写入的字节数
+    """
+    written = 0
+    start = 0
+    if checkpoint:
+        # 输出流只能追加,只有从头开始连续完成的 ts 文件才能跳过
+        while checkpoint.is_done(start):
+            written += checkpoint.segments[start]
+            start += 1
+        progress_bar.addition(written)
+
+    tasks = list(enumerate(ts_urls))[start:]
+    try:
+        for i, content in decrypt_ordered(fetch_ts_ordered(tasks, workers), key, ivs):
+            progress_bar.addition(len(content))
+            with profiler.phase('write'):
+                output.write(content)
+            written += len(content)
+            buffer_pool.put(content)
+            if checkpoint:
+                # 记录中的 ts 文件必须已经写入文件
+                output.flush()
+                checkpoint.done(i, len(content))
+    finally:
+        if checkpoint:
+            checkpoint.flush()
+    return written
+
+
+def download_ts_file(ts_urls, key, output_path: Path, progress_bar, workers: int = 1, ivs=None):
+    """
+    下载 m3u8 ts 文件列表并合并成一个 ts 文件
+    下载过程中写入 .part 临时文件,中断后再次下载会从断点继续
+    @param ts_urls: ts 文件列表
+    @param key: 解密文件,没有不进行解密
+    @param output_path: 输出文件路径
+    @param progress_bar: 下载进度条
+    @param workers: 并发下载数
+    @param ivs: 每个 ts 文件的初始向量,为空时使用 key
+    @return:
+    """
+    part_path = output_path.with_name(f"{output_path.name}.part")
+    checkpoint = Checkpoint(output_path.with_name(f"{output_path.name}.json"), key, playlist_fingerprint(ts_urls))
+    if not part_path.exists():
+        checkpoint.segments.clear()
+
+    with open(part_path, 'ab') as f:
+        # 丢弃上次中断时写入了一半的 ts 文件
+        start = 0
+        while checkpoint.is_done(start):
+            start += 1
+        f.truncate(sum(checkpoint.segments[i] for i in range(start)))
+        ts_range = get_ts_range(ts_urls[-1])
+        if ts_range:
+            reserve_space(f, ts_range[1] + 1)
+        download_ts_stream(ts_urls, key, f, progress_bar, workers, checkpoint, ivs)
+
+    part_path.replace(output_path)
+    checkpoint.remove()
+
+
+def download_ts_ffmpeg(ts_urls, key, output_path: Path, progress_bar, workers: int = 1, ivs=None):
+    """
+    下载 m3u8 ts 文件列表,解密后通过管道直接交给 ffmpeg 合成视频
+    @param ts_urls: ts 文件列表
+    @param key: 解密文件,没有不进行解密
+    @param output_path: 输出文件路径
+    @param progress_bar: 下载进度条
+    @param workers: 并发下载数
+    @param ivs: 每个 ts 文件的初始向量,为空时使用 key
+    @return:
+    """
+    tmp_path = output_path.with_name(f"{output_path.stem}.tmp{output_path.suffix}")
+    cmd = ['ffmpeg', '-y', '-f', 'mpegts', '-i', 'pipe:0', '-c', 'copy', str(tmp_path)]
+    process = Popen(cmd, stdin=PIPE, stdout=DEVNULL, stderr=DEVNULL)
+    try:
+        try:
+            download_ts_stream(ts_urls, key, process.stdin, progress_bar, workers, ivs=ivs)
+        except BrokenPipeError:
+            # ffmpeg 提前退出,错误由返回值报告
+            pass
+        finally:
+            process.stdin.close()
+            with profiler.phase('merge', output_path.name):
+                returncode = process.wait()
+        if returncode != 0:
+            raise Exception(f"合成 {output_path.name} 失败,ffmpeg 返回 {returncode}")
+        tmp_path.replace(output_path)
+    finally:
+        # 下载、解密或合成失败时删除不完整的临时文件
+        tmp_path.unlink(missing_ok=True)
+
+
+def write_at(f, mapped, offset, data):
+    """
+    将数据写入文件的指定位置,不改变文件指针,多个线程可以同时写入
+    @param f: 打开的文件
+    @param mapped: 文件的内存映射,不支持 os.pwrite 的系统(Windows)使用
+    @param offset: 写入位置
+    @param data: 数据
+    """
+    if mapped is not None:
+        mapped[offset:offset + len(data)] = data
+        return
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(f.fileno(), view, offset)
+        view = view[written:]
+        offset += written
+
+
+def download_ts_assemble(ts_urls, key, output_path: Path, progress_bar, workers: int = 1, ivs=None):
+    """
+    乱序下载 m3u8 ts 文件列表,解密后直接写入输出文件中各自的位置,合并成一个 ts 文件
+    每个 ts 文件的位置来自链接中的 start,end 参数,输出文件预先分配好大小,
+    不需要按顺序缓存 ts 文件,也不产生 ts 碎片文件;已完成的 ts 文件记录在位图断点中,中断后再次下载会继续
+    @param ts_urls: ts 文件列表,链接中需要有 start,end 参数
+    @param key: 解密文件,没有不进行解密
+    @param output_path: 输出文件路径
+    @param progress_bar: 下载进度条
+    @param workers: 并发下载数
+    @param ivs: 每个 ts 文件的初始向量,为空时使用 key
+    @return:
+    """
+    ranges = [get_ts_range(ts_url) for ts_url in ts_urls]
+    if None in ranges:
+        raise ValueError("ts 链接中没有 start,end 参数,不能直接写入对应位置")
+    size = max(end for _, end in ranges) + 1
+
+    part_path = output_path.with_name(f"{output_path.name}.part")
+    checkpoint = BitmapCheckpoint(output_path.with_name(f"{output_path.name}.json"), key, len(ts_urls),
+                                  playlist_fingerprint(ts_urls))
+    if not part_path.exists():
+        checkpoint.clear()
+    pending = [i for i in range(len(ts_urls)) if not checkpoint.is_done(i)]
+    progress_bar.addition(sum(
+        end - start + 1 for i, (start, end) in enumerate(ranges) if checkpoint.is_done(i)
+    ))
+
+    with open(part_path, 'r+b' if part_path.exists() else 'w+b') as f:
+        preallocate(f, size)
+        mapped = None if hasattr(os, 'pwrite') else mmap.mmap(f.fileno(), size)
+
+        def download(i):
+            start, end = ranges[i]
+            content = fetch_ts(ts_urls[i])
+            if len(content) != end - start + 1:
+                raise IOError(f"ts 文件大小 {len(content)} 与链接中的范围 {start}-{end} 不一致: {ts_urls[i]}")
+            if key:
+                content = decrypt_pool.decrypt_into(content, key, ivs[i] if ivs else key)
+            with profiler.phase('write'):
+                write_at(f, mapped, start, content)
+            buffer_pool.put(content)
+            checkpoint.done(i)
+            progress_bar.addition(end - start + 1)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                futures = [executor.submit(profiler.bind(download), i) for i in pending]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            checkpoint.flush()
+            if mapped is not None:
+                mapped.close()
+        f.truncate(size)
+
+    part_path.replace(output_path)
+    checkpoint.remove()
+
+
+def rewrite_m3u8(content: str, base_url: str, handle_key_url=None, handle_ts_url=None):
+    """
+    逐行改写 m3u8 文件内容,只遍历一次
+    @param content: m3u8 文件内容
+    @param base_url: m3u8 文件链接,处理后的相对路径会拼接为完整路径
+    @param handle_key_url: 处理 key_url 的函数,见 download_m3u8
+    @param handle_ts_url: 处理 ts_url 的函数,见 download_m3u8
+    @return: 生成器,产生改写后的每一行(包含换行符)
+    """
+    i = 0
+    for line in content.splitlines():
+        if line.startswith('#EXT-X-KEY') and handle_key_url:
+            line = KEY_URI_PATTERN.sub(lambda m: f'URI="{handle_key_url(m.group(1))}"', line)
+        elif line and not line.startswith('#'):
+            if handle_ts_url:
+                line = handle_ts_url(i, line)
+            line = urljoin(base_url, line)
+            i += 1
+        yield line + '\n'
+
+
+def download_m3u8(m3u8_url, output_path: Path, handle_key_url=None, handle_ts_url=None, headers: str = None,
+                  pipe: bool = True):
     """
     下载 m3u8
     @param m3u8_url: m3u8 文件链接
@@ -88,34 +426,54 @@ def download_m3u8(m3u8_url, output_path: Path, handle_key_url=None, handle_ts_ur
     @param handle_key_url: 处理 key_url 的函数 handle_key_url(key_url)->new_key_url key_url:解析到的 key_url
     @param handle_ts_url: 处理 ts_url 的函数 handle_ts_url(i,ts_url)->new_ts_url i:ts_url 的索引,ts_url: 解析到的 ts_url
     @param headers: 请求的 headers,使用 ; 分隔每一项 header
+                    ffmpeg 只会把 headers 转发给从 http 打开的 m3u8,所以只在不需要改写 m3u8 时生效
+    @param pipe: 通过管道把改写后的 m3u8 交给 ffmpeg,为 False 时先写入 video.m3u8 文件
     @return:
     """
-    content = get_m3u8_content(m3u8_url)
-    key_url, ts_urls = parse_m3u8(m3u8_url, content, join_ts_url=False)
-
-    # 处理 key_url
-    if handle_key_url and callable(handle_key_url):
-        new_key_url = handle_key_url(key_url)
-        content = content.replace(key_url, new_key_url)
-
-    # 处理 ts_urls
-    if handle_ts_url and callable(handle_ts_url):
-        for i, ts_url in enumerate(ts_urls):
-            new_ts_url = handle_ts_url(i, ts_url)
-            content = content.replace(ts_url, new_ts_url)
-
-    m3u8_file = output_path.parent.joinpath("video.m3u8")
-    m3u8_file.write_text(content)
+    tmp_path = output_path.with_name(f"{output_path.stem}.tmp{output_path.suffix}")
+    cmd = ['ffmpeg', '-y', '-allowed_extensions', 'ALL', '-protocol_whitelist', 'file,http,https,tls,tcp,crypto,pipe']
+    lines = m3u8_file = None
+    if not handle_key_url and not handle_ts_url:
+        # 不需要改写时让 ffmpeg 直接打开 m3u8 链接,headers 会随之用于 key 和 ts 的请求;
+        # 输入是管道或本地文件时 ffmpeg 不认识 -headers,会直接报错退出
+        if headers:
+            cmd += ['-headers', ''.join(f"{header.strip()}\r\n" for header in headers.split(';') if header.strip())]
+        cmd += ['-i', m3u8_url]
+    else:
+        content = get_m3u8_content(m3u8_url)
+        if "#EXTM3U" not in content:
+            raise Exception("非 m3u8 的链接")
+        lines = rewrite_m3u8(content, m3u8_url, handle_key_url, handle_ts_url)
+        if pipe:
+            cmd += ['-f', 'hls', '-i', 'pipe:0']
+        else:
+            m3u8_file = output_path.parent.joinpath(f"{output_path.stem}.m3u8")
+            with m3u8_file.open('w') as f:
+                f.writelines(lines)
+            lines = None
+            cmd += ['-i', str(m3u8_file)]
+    cmd += ['-c', 'copy', str(tmp_path)]
 
     # 下载 m3u8
-    cmd = f'ffmpeg -allowed_extensions ALL -protocol_whitelist "file,http,https,tls,tcp,crypto"'
-    cmd += f' -i "{m3u8_file}" -c copy "{output_path}"'
-
-    if headers:
-        cmd += f' -headers "{headers}"'
-    Popen(cmd, shell=True, stdout=DEVNULL, stderr=DEVNULL).wait()
-    # 删除 m3u8 文件
-    m3u8_file.unlink()
+    with TemporaryFile() as stderr:
+        process = Popen(cmd, stdin=PIPE if lines else DEVNULL, stdout=DEVNULL, stderr=stderr)
+        if lines:
+            try:
+                for line in lines:
+                    process.stdin.write(line.encode())
+            except BrokenPipeError:
+                pass
+            finally:
+                process.stdin.close()
+        returncode = process.wait()
+        if m3u8_file:
+            # 删除 m3u8 文件
+            m3u8_file.unlink()
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors='ignore').strip().splitlines()[-1:]
+            raise Exception(f"下载 {output_path.name} 失败,ffmpeg 返回 {returncode} {''.join(message)}")
+    tmp_path.replace(output_path)
 
 
 def merge_ts_ffmpeg(ts_files, output_path: Path):
@@ -129,18 +487,26 @@ def merge_ts_ffmpeg(ts_files, output_path: Path):
     output_dir = output_path.parent
 
     # 生成 ts_files.txt
-    ts_files_txt = output_dir.joinpath("ts_files.txt")
-    with ts_files_txt.open('w') as fp:
+    ts_files_txt = output_dir.joinpath(f"{output_path.stem}.ts_files.txt")
+    with ts_files_txt.open('w', encoding='utf-8') as fp:
         for ts_file in ts_files:
-            fp.write(f"file '{ts_file}'\n")
-    # 合成视频
-    cmd = f'ffmpeg -f concat -safe 0 -i "{ts_files_txt}" -c copy "{output_path}"'
-    Popen(cmd, shell=True, stdout=DEVNULL, stderr=DEVNULL).wait()
+            # 路径中有视频名,其中的 ' 需要转义成 '\''
+            escaped = str(ts_file).replace("'", "'\\''")
+            fp.write(f"file '{escaped}'\n")
+    # 合成视频,先输出到临时文件,完成后再重命名,避免中断时留下不完整的视频
+    tmp_path = output_path.with_name(f"{output_path.stem}.tmp{output_path.suffix}")
+    cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', str(ts_files_txt), '-c', 'copy', str(tmp_path)]
+    with merge_seconds.time(), profiler.phase('merge', output_path.name):
+        returncode = Popen(cmd, stdout=DEVNULL, stderr=DEVNULL).wait()
     # 删除 ts_files.txt
     ts_files_txt.unlink()
+    if returncode != 0:
+        # 保留 ts 文件,下次运行时可以直接合并
+        raise Exception(f"合并 {output_path.name} 失败,ffmpeg 返回 {returncode}")
+    tmp_path.replace(output_path)
     # 删除 ts 文件
-    del_ts_cmd = f'del /Q "{output_dir.joinpath("*.ts")}"'
-    Popen(del_ts_cmd, shell=True, stdout=DEVNULL, stderr=DEVNULL).wait()
+    for ts_file in ts_files:
+        Path(ts_file).unlink()
 
 
 def merge_ts_copy(ts_dir: Path, output_path: Path):
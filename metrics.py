@@ -0,0 +1,230 @@
+import atexit
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Thread, Event, Lock
+
+import urls
+from quality import throughput_meter
+from settings import METRICS_PATH, METRICS_INTERVAL
+
+# 默认的耗时分桶(秒)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 默认的大小分桶(字节)
+SIZE_BUCKETS = tuple(2 ** n * 1024 for n in range(0, 16, 2))
+
+
+def format_labels(labels):
+    """标签格式化为 Prometheus 格式 {name="value",...}"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Counter:
+    """计数器,只增不减"""
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        """@return: [(指标名, 标签, 值)]"""
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def snapshot(self):
+        with self.lock:
+            return [{'labels': dict(key), 'value': value} for key, value in self.values.items()]
+
+
+class Gauge:
+    """仪表,导出时调用 func 获取当前值"""
+    type = 'gauge'
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        return [] if value is None else [(self.name, (), value)]
+
+    def snapshot(self):
+        return [{'labels': {}, 'value': value} for _, _, value in self.samples()]
+
+
+class Histogram:
+    """直方图,记录样本的分布以及总和、数量"""
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # {标签: [各分桶计数, 总和, 数量]}
+        self.values = {}
+        self.lock = Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 语句块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", key + (('le', bound),), cumulative))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                {
+                    'labels': dict(key),
+                    'buckets': dict(zip(map(str, self.buckets + ('+Inf',)), counts)),
+                    'sum': total,
+                    'count': count,
+                }
+                for key, (counts, total, count) in self.values.items()
+            ]
+
+
+class Registry:
+    """
+    指标注册表
+    可以导出为 Prometheus 文本格式或 json,并定时写入文件
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.thread = None
+        self.stop_event = Event()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help, func):
+        return self.register(Gauge(name, help, func))
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def to_prometheus(self):
+        """@return: Prometheus 文本格式"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        """@return: json 快照"""
+        return json.dumps({
+            'time': time.time(),
+            'metrics': {metric.name: {'type': metric.type, 'values': metric.snapshot()} for metric in self.metrics},
+        }, ensure_ascii=False, indent=2)
+
+    def export(self, path):
+        """
+        导出到文件,先写临时文件再替换
+        @param path: 文件路径,以 .json 结尾时导出 json,否则导出 Prometheus 文本格式
+        """
+        path = Path(path)
+        content = self.to_json() if path.suffix == '.json' else self.to_prometheus()
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(content, encoding='utf-8')
+        os.replace(tmp_path, path)
+
+    def start_export(self, path=METRICS_PATH, interval=METRICS_INTERVAL):
+        """
+        每隔 interval 秒导出一次,退出时再导出一次
+        @param path: 文件路径,为空时不导出
+        @param interval: 导出间隔(秒)
+        """
+        if not path or self.thread is not None:
+            return
+
+        def run():
+            while not self.stop_event.wait(interval):
+                self.export(path)
+
+        self.thread = Thread(target=run, name='metrics', daemon=True)
+        self.thread.start()
+        atexit.register(self.export, path)
+
+
+metrics = Registry()
+
+segment_seconds = metrics.histogram('qcourse_segment_seconds', 'ts 文件下载耗时')
+segment_bytes = metrics.histogram('qcourse_segment_bytes', 'ts 文件大小', SIZE_BUCKETS)
+downloaded_bytes = metrics.counter('qcourse_downloaded_bytes_total', '下载的字节数')
+retries = metrics.counter('qcourse_retries_total', '请求失败后的重试次数')
+hedged_requests = metrics.counter('qcourse_hedged_requests_total', '超过分位延迟后发起的重复请求数')
+api_seconds = metrics.histogram('qcourse_api_seconds', '接口请求耗时,按 urls.py 中的接口名区分')
+key_fetch_seconds = metrics.histogram('qcourse_key_fetch_seconds', '秘钥请求耗时')
+decrypt_seconds = metrics.histogram('qcourse_decrypt_seconds', '解密耗时')
+download_speed = metrics.gauge('qcourse_download_speed_bytes', '当前 ts 文件下载速度(字节/秒)', lambda: throughput_meter.speed)
+merge_seconds = metrics.histogram('qcourse_merge_seconds', '合并 ts 文件耗时', TIME_BUCKETS + (120, 300, 600))
+
+# urls.py 中的接口 {链接前缀: 接口名},按前缀长度从长到短排列
+ENDPOINTS = sorted(
+    (
+        (value.split('?')[0].split('{')[0], name)
+        for name, value in vars(urls).items()
+        if not name.startswith('_') and isinstance(value, str)
+    ),
+    key=lambda item: len(item[0]),
+    reverse=True,
+)
+
+
+def get_endpoint(url):
+    """
+    获取链接对应的 urls.py 中的接口名
+    @param url: 请求链接
+    @return: 接口名,不是 urls.py 中的接口时返回 None
+    """
+    for prefix, name in ENDPOINTS:
+        if url.startswith(prefix):
+            return name
+    return None
@@ -0,0 +1,192 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+
+# 未开启时 phase 返回的空上下文,不产生额外开销
+NULL_PHASE = nullcontext()
+
+
+class Profiler:
+    """
+    分阶段性能分析
+    记录每个视频各阶段(元数据,播放列表,秘钥,ts 下载,解密,写入,合并)的耗时,
+    输出 Chrome trace / Perfetto 可以打开的 json 时间线,并打印各阶段的耗时汇总;
+    可选地为每个阶段收集 cProfile 统计及 tracemalloc 内存快照
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.cprofile = False
+        self.tracemalloc = False
+        self.events = []
+        self.thread_names = {}
+        self.stats = {}
+        # {阶段: (内存增长, 快照)},只保留内存增长最多的一次
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start_time = 0.0
+
+    def start(self, path='profile.json', cprofile=False, trace_malloc=False):
+        """
+        开始记录
+        @param path: 时间线 json 文件路径,cProfile 及 tracemalloc 的结果保存在同一目录
+        @param cprofile: 是否为每个阶段收集 cProfile 统计
+        @param trace_malloc: 是否记录每个阶段的内存分配,开启后程序会明显变慢
+        """
+        self.path = Path(path)
+        self.cprofile = cprofile
+        self.tracemalloc = trace_malloc
+        if trace_malloc:
+            tracemalloc.start()
+        self.start_time = time.perf_counter()
+        self.enabled = True
+
+    def phase(self, name, video=None):
+        """
+        记录一个阶段
+        @param name: 阶段名
+        @param video: 视频名,显示在时间线的事件参数中;为空时使用外层阶段的视频名
+        @return: 上下文管理器
+        """
+        if not self.enabled:
+            return NULL_PHASE
+        return self.record(name, video)
+
+    def bind(self, func):
+        """
+        让提交到线程池的任务沿用当前线程的视频名
+        @param func: 任务函数
+        @return: 包装后的函数,未开启或没有视频名时返回 func 本身
+        """
+        video = getattr(self.local, 'video', None) if self.enabled else None
+        if video is None:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = getattr(self.local, 'video', None)
+            self.local.video = video
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.local.video = previous
+
+        return wrapper
+
+    @contextmanager
+    def record(self, name, video):
+        thread = threading.current_thread()
+        # 嵌套的阶段及 bind 的任务都沿用这个视频名
+        outer_video = getattr(self.local, 'video', None)
+        video = video or outer_video
+        self.local.video = video
+        profile = None
+        # 同一线程同时只能有一个 cProfile,嵌套的阶段计入外层阶段
+        if self.cprofile and not getattr(self.local, 'profiling', False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.local.profiling = True
+            except ValueError:
+                # 其他线程正在使用(Python 3.12 起 cProfile 是全局的)
+                profile = None
+        memory = tracemalloc.get_traced_memory()[0] if self.tracemalloc else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.local.video = outer_video
+            if profile is not None:
+                profile.disable()
+                self.local.profiling = False
+            args = {'video': video} if video else {}
+            if memory is not None:
+                args['memory_delta'] = tracemalloc.get_traced_memory()[0] - memory
+            self.events.append({
+                'name': name,
+                'cat': name,
+                'ph': 'X',
+                'ts': (start - self.start_time) * 1_000_000,
+                'dur': (end - start) * 1_000_000,
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args,
+            })
+            self.thread_names[thread.ident] = thread.name
+            if profile is not None:
+                self.add_stats(name, profile)
+            if memory is not None:
+                self.add_snapshot(name, args['memory_delta'])
+
+    def add_stats(self, name, profile):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                self.stats[name] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def add_snapshot(self, name, memory_delta):
+        """
+        阶段内存增长超过之前的最大值时保存快照
+        tracemalloc 统计的是整个进程,其他线程同时分配的内存也会计入
+        """
+        with self.lock:
+            previous = self.snapshots.get(name)
+            if previous is None or memory_delta > previous[0]:
+                self.snapshots[name] = (memory_delta, tracemalloc.take_snapshot())
+
+    def summary(self):
+        """
+        各阶段的耗时汇总
+        @return: [(阶段, 次数, 累计耗时, 平均耗时, 最大耗时)],耗时单位为秒
+        """
+        phases = {}
+        for event in list(self.events):
+            phases.setdefault(event['name'], []).append(event['dur'] / 1_000_000)
+        return sorted(
+            ((name, len(durations), sum(durations), sum(durations) / len(durations), max(durations))
+             for name, durations in phases.items()),
+            key=lambda item: item[2],
+            reverse=True,
+        )
+
+    def stop(self):
+        """停止记录,保存结果并打印汇总"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        wall_time = time.perf_counter() - self.start_time
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+            for tid, name in self.thread_names.items()
+        ]
+        self.path.write_text(json.dumps({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}))
+
+        for name, stats in self.stats.items():
+            stats.dump_stats(self.path.with_name(f"{self.path.stem}.{name}.prof"))
+        for name, (memory_delta, snapshot) in self.snapshots.items():
+            top = snapshot.statistics('lineno')[:20]
+            self.path.with_name(f"{self.path.stem}.{name}.tracemalloc.txt").write_text(
+                f"memory delta: {memory_delta} bytes\n" + '\n'.join(map(str, top)) + '\n', encoding='utf-8')
+        if self.tracemalloc:
+            tracemalloc.stop()
+
+        # 阶段在多个线程中同时进行,累计耗时可能超过总耗时
+        print(f"性能分析结果已保存到 {self.path},总耗时 {wall_time:.1f}s")
+        print(f"{'阶段':<12}{'次数':>8}{'累计(s)':>12}{'平均(ms)':>12}{'最大(ms)':>12}")
+        for name, count, total, average, maximum in self.summary():
+            print(f"{name:<12}{count:>8}{total:>12.2f}{average * 1000:>12.1f}{maximum * 1000:>12.1f}")
+
+
+profiler = Profiler()
@@ -1,7 +1,11 @@
+import argparse
 import re
 from uuid import uuid1
 
 from logger import logger
+from cache import cache
+from metrics import metrics
+from profiler import profiler
 from settings import COURSES_PATH, COOKIES_PATH
 from apis import (
     choose_course,
@@ -14,8 +18,11 @@ from apis import (
     get_courses_from_chapter,
     parse_course_url,
     get_m3u8_url,
-    download_course
+    get_output_path,
+    download_course,
+    get_key_url_token
 )
+from scheduler import DownloadJob, DownloadScheduler
 
 
 def download_from_course_url(course_url, filename=None, path=None):
@@ -33,19 +40,22 @@ def download_from_course_url(course_url, filename=None, path=None):
 
     cid, term_id, file_id = parse_course_url(course_url)
 
-    m3u8_url = get_m3u8_url(cid, term_id, file_id)
-    download_course(m3u8_url, cid, term_id, path.joinpath(f"{filename}.mp4"))
+    with profiler.phase('metadata', filename):
+        m3u8_url = get_m3u8_url(cid, term_id, file_id)
+    with profiler.phase('video', filename):
+        download_course(m3u8_url, cid, term_id, path.joinpath(f"{filename}.mp4"))
 
 
-def download_from_selected_chapter(cid, term_id, tasks, chapter_path):
+def get_download_jobs(cid, term_id, tasks, chapter_path):
     """
-    从选择的章节进行下载
+    从章节任务中获取需要下载的视频
     @param cid: 课程ID
     @param term_id: 学期ID
     @param tasks: 任务列表
     @param chapter_path: 章节目录
-    @return:
+    @return: 下载任务列表
     """
+    jobs = []
     for task in tasks:
         # 任务名
         task_name = task.get('name')
@@ -55,28 +65,56 @@ def download_from_selected_chapter(cid, term_id, tasks, chapter_path):
         if task_type == 2:
             file_id = task.get('resid_list')
             file_id = re.search(r'(\d+)', file_id).group(1)
-            m3u8_url = get_m3u8_url(cid, term_id, file_id)
             filename = task_name.replace('/', '／').replace('\\', '＼')
             filepath = chapter_path.joinpath(f"{filename}.mp4")
             # 判断是否下载过
-            if filepath.exists():
-                print(f"{filepath} 已存在！")
+            if get_output_path(filepath).exists():
+                print(f"{get_output_path(filepath)} 已存在！")
                 continue
-            download_course(m3u8_url, cid, term_id, filepath)
+            jobs.append(DownloadJob(cid, term_id, file_id, filepath))
         else:
             print(f"{task_name} 类型暂不支持下载")
+    return jobs
 
 
 def clear_cookies():
     """
-    清除保存的 cookies 文件
+    清除保存的 cookies 文件及接口缓存,缓存中可能有当前账号的数据
     """
     if COOKIES_PATH.exists():
         COOKIES_PATH.unlink()
+    cache.invalidate()
+
+
+def clear_cache():
+    """
+    清除接口缓存
+    """
+    cache.invalidate()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='腾讯课堂视频下载')
+    parser.add_argument('--profile', nargs='?', const='profile.json', metavar='PATH',
+                        help='记录每个视频各阶段的耗时,保存为 Chrome trace / Perfetto 时间线 json(默认 profile.json)')
+    parser.add_argument('--cprofile', action='store_true', help='配合 --profile,为每个阶段保存 cProfile 统计')
+    parser.add_argument('--tracemalloc', action='store_true', help='配合 --profile,为每个阶段保存内存分配快照')
+    return parser.parse_args()
 
 
 def main():
-    menus = ["下载链接视频", "下载我的课程", "清除登录"]
+    args = parse_args()
+    metrics.start_export()
+    if args.profile:
+        profiler.start(args.profile, args.cprofile, args.tracemalloc)
+    try:
+        run()
+    finally:
+        profiler.stop()
+
+
+def run():
+    menus = ["下载链接视频", "下载我的课程", "清除登录", "清除缓存"]
     for i, menu in enumerate(menus):
         print(f"{i + 1}. {menu}")
     chosen = int(input('\n输入需要的功能：'))
@@ -101,24 +139,29 @@ def main():
         # 选择章节
         chapters = choose_chapters(term)
         print(f"即将开始下载共计 {len(chapters)} 个章节的内容")
+        jobs = []
         for chapter in chapters:
             chapter_name = chapter.get('name').replace('/', '／').replace('\\', '＼')
             chapter_id = chapter.get("sub_id")
             chapter_name = f"{chapter_id + 1}.{chapter_name}"
             tasks = get_courses_from_chapter(chapter)
-            print('=' * 50)
-            print(f"即将开始下载章节：{chapter_name}")
 
             # 处理章节目录
             chapter_path = COURSES_PATH.joinpath(course_name, chapter_name)
             if not chapter_path.exists():
                 chapter_path.mkdir(parents=True)
 
-            download_from_selected_chapter(
-                cid, term_id, tasks, chapter_path
-            )
+            jobs.extend(get_download_jobs(cid, term_id, tasks, chapter_path))
+
+        # 提前获取用户信息,需要输入 uin 时不会被下载进度打断
+        get_key_url_token(cid, term_id)
+        print('=' * 50)
+        print(f"即将开始下载共计 {len(jobs)} 个视频")
+        DownloadScheduler().run(jobs)
     elif chosen == 3:
         clear_cookies()
+    elif chosen == 4:
+        clear_cache()
     else:
         print('请输入正确的序号！')
 
@@ -0,0 +1,123 @@
+import time
+from threading import Lock
+
+from settings import QUALITY_BUDGET_SECONDS, QUALITY_BUDGET_BYTES
+
+
+class ThroughputMeter:
+    """
+    下载速度统计
+    统计整个运行过程中所有下载的总速度,每秒采样一次并做指数加权平均
+    """
+
+    def __init__(self, alpha=0.3, interval=1.0):
+        """
+        @param alpha: 新样本的权重
+        @param interval: 采样间隔(秒)
+        """
+        self.alpha = alpha
+        self.interval = interval
+        self.lock = Lock()
+        self.total = 0
+        self.sample_bytes = 0
+        self.sample_time = None
+        self.rate = None
+
+    def add(self, size):
+        """
+        记录下载的字节数
+        @param size: 字节数
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.total += size
+            if self.sample_time is None:
+                self.sample_time = now
+                return
+            self.sample_bytes += size
+            elapsed = now - self.sample_time
+            if elapsed >= self.interval:
+                rate = self.sample_bytes / elapsed
+                self.rate = rate if self.rate is None else self.alpha * rate + (1 - self.alpha) * self.rate
+                self.sample_bytes = 0
+                self.sample_time = now
+
+    @property
+    def speed(self):
+        """当前下载速度(字节/秒),还没有足够样本时为 None"""
+        return self.rate
+
+
+throughput_meter = ThroughputMeter()
+
+
+def estimate_size(info):
+    """
+    某个清晰度的视频大小
+    @param info: rec_video_info['infos'] 中的一项
+    @return: 接口返回的文件大小(字节),没有该字段时抛出 ValueError
+    """
+    size = info.get('size')
+    if not size:
+        raise ValueError(f"视频信息中没有文件大小(size),无法按预算选择清晰度: {sorted(info)}")
+    return int(size)
+
+
+class QualityPlanner:
+    """
+    按预算选择清晰度
+    将剩余的时间或流量预算平均分给剩余的视频,为每个视频选择不超过其份额的最高清晰度
+    时间预算按本次运行实测的下载速度换算成字节数
+    """
+
+    def __init__(self, videos, budget_seconds=QUALITY_BUDGET_SECONDS, budget_bytes=QUALITY_BUDGET_BYTES,
+                 meter=throughput_meter):
+        """
+        @param videos: 需要下载的视频数
+        @param budget_seconds: 所有视频的下载时间预算(秒)
+        @param budget_bytes: 所有视频的下载流量预算(字节)
+        @param meter: 下载速度统计
+        """
+        self.remaining = videos
+        self.budget_seconds = budget_seconds
+        self.budget_bytes = budget_bytes
+        self.meter = meter
+        self.start = time.monotonic()
+        self.start_bytes = meter.total
+        self.planned_bytes = 0
+        self.lock = Lock()
+
+    @property
+    def enabled(self):
+        return self.budget_seconds is not None or self.budget_bytes is not None
+
+    def share(self):
+        """当前视频可用的字节数,没有预算或无法估算时为 None"""
+        shares = []
+        remaining = max(self.remaining, 1)
+        if self.budget_bytes is not None:
+            shares.append((self.budget_bytes - self.planned_bytes) / remaining)
+        if self.budget_seconds is not None and self.meter.speed:
+            seconds = self.budget_seconds - (time.monotonic() - self.start)
+            # 已经选择但还没下载完的视频也要占用剩余时间
+            pending = max(0, self.planned_bytes - (self.meter.total - self.start_bytes))
+            shares.append((seconds * self.meter.speed - pending) / remaining)
+        return min(shares) if shares else None
+
+    def choose(self, rec_video_info):
+        """
+        选择清晰度
+        @param rec_video_info: 视频信息
+        @return: video_index,越清晰的排序越靠前(0 最高)
+        """
+        sizes = [estimate_size(info) for info in rec_video_info.get('infos')]
+        with self.lock:
+            share = self.share()
+            self.remaining -= 1
+            index = 0
+            if share is not None:
+                # 都超出份额时选择最低清晰度
+                index = next((i for i, size in enumerate(sizes) if size <= share), len(sizes) - 1)
+            # 还没有速度样本时选择最高清晰度,同样计入已选择的大小,后面视频的份额相应减少
+            self.planned_bytes += sizes[index]
+            return index
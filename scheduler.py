@@ -0,0 +1,212 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+
+from ProgressBarUtils import progress_renderer
+from apis import get_rec_video_info, parse_m3u8_url, resolve_course, download_course
+from logger import logger
+from profiler import profiler
+from quality import QualityPlanner
+from settings import VIDEO_WORKERS, METADATA_LOOKAHEAD, URL_EXPIRE_MARGIN
+from utils import get_url_expire
+
+
+class DownloadJob:
+    """单个视频的下载任务"""
+
+    def __init__(self, cid, term_id, file_id, filepath: Path):
+        """
+        @param cid: 课程ID
+        @param term_id: 学期ID
+        @param file_id: 文件ID
+        @param filepath: 保存文件路径
+        """
+        self.cid = cid
+        self.term_id = term_id
+        self.file_id = file_id
+        self.filepath = filepath
+
+    @property
+    def name(self):
+        return self.filepath.name
+
+
+class DownloadResult:
+    """单个视频的下载结果"""
+
+    def __init__(self, job: DownloadJob, time_cost, error=None):
+        """
+        @param job: 下载任务
+        @param time_cost: 耗时(秒)
+        @param error: 下载失败时的异常
+        """
+        self.job = job
+        self.time_cost = time_cost
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class VideoMetadata:
+    """下载单个视频所需的元数据"""
+
+    def __init__(self, video_index, m3u8_url, key, ts_urls, ivs):
+        """
+        @param video_index: 视频清晰度
+        @param m3u8_url: m3u8 链接
+        @param key: 秘钥
+        @param ts_urls: ts 文件列表
+        @param ivs: 每个 ts 文件的初始向量
+        """
+        self.video_index = video_index
+        self.m3u8_url = m3u8_url
+        self.key = key
+        self.ts_urls = ts_urls
+        self.ivs = ivs
+        expires = [get_url_expire(url) for url in (m3u8_url, *ts_urls[:1])]
+        expires = [expire for expire in expires if expire]
+        self.expire = min(expires) if expires else None
+
+    @property
+    def expired(self):
+        """签名链接是否已经过期或即将过期"""
+        return self.expire is not None and self.expire - URL_EXPIRE_MARGIN < time.time()
+
+    @classmethod
+    def resolve(cls, job: DownloadJob, planner: QualityPlanner = None, video_index=None):
+        """
+        获取视频信息,解析 m3u8 及秘钥
+        @param job: 下载任务
+        @param planner: 按预算选择清晰度,为空时下载最高清晰度
+        @param video_index: 指定清晰度,不为空时不再通过 planner 选择
+        @return: VideoMetadata
+        """
+        with profiler.phase('metadata', job.name):
+            rec_video_info = get_rec_video_info(job.cid, job.term_id, job.file_id)
+        if video_index is None:
+            video_index = planner.choose(rec_video_info) if planner else 0
+        m3u8_url = parse_m3u8_url(rec_video_info, video_index)
+        return cls(video_index, m3u8_url, *resolve_course(m3u8_url, job.cid, job.term_id))
+
+
+class MetadataPrefetcher:
+    """
+    元数据预取
+    在下载当前视频的同时,提前解析后面 lookahead 个视频的元数据
+    取用时签名链接已经过期的元数据会重新解析
+    """
+
+    def __init__(self, jobs, lookahead=METADATA_LOOKAHEAD, planner: QualityPlanner = None):
+        """
+        @param jobs: 下载任务列表
+        @param lookahead: 提前解析的视频数
+        @param planner: 按预算选择清晰度
+        """
+        self.jobs = jobs
+        self.planner = planner
+        self.lookahead = lookahead
+        self.futures = {}
+        self.submitted = 0
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, lookahead), thread_name_prefix='metadata')
+
+    def fill(self, end):
+        """提交 end 之前还没有开始解析的任务"""
+        with self.lock:
+            end = min(end, len(self.jobs))
+            while self.submitted < end:
+                job = self.jobs[self.submitted]
+                self.futures[self.submitted] = self.executor.submit(VideoMetadata.resolve, job, self.planner)
+                self.submitted += 1
+
+    def get(self, index):
+        """
+        获取第 index 个任务的元数据,同时开始解析后面的任务
+        @param index: 任务索引
+        @return: VideoMetadata
+        """
+        self.fill(index + 1 + self.lookahead)
+        with self.lock:
+            future = self.futures.pop(index)
+        metadata = future.result()
+        if metadata.expired:
+            logger.info(f"{self.jobs[index].name} 链接已过期,重新解析")
+            metadata = VideoMetadata.resolve(self.jobs[index], video_index=metadata.video_index)
+        return metadata
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class DownloadScheduler:
+    """
+    视频下载调度器
+    跨章节同时下载多个视频,每个视频依次获取 m3u8 链接、下载、合并,视频之间互不影响
+    后面视频的元数据在下载的同时提前解析
+    所有视频同时进行的 ts 请求数由 m3u8Utils 中的全局信号量限制
+    """
+
+    def __init__(self, video_workers=VIDEO_WORKERS):
+        """
+        @param video_workers: 同时下载的视频数
+        """
+        self.video_workers = video_workers
+
+    @staticmethod
+    def download(job: DownloadJob, prefetcher: MetadataPrefetcher, index):
+        """
+        下载单个视频,失败时不抛出异常,记录在下载结果中
+        @param job: 下载任务
+        @param prefetcher: 元数据预取
+        @param index: 任务索引
+        @return: 下载结果
+        """
+        start = time.time()
+        try:
+            metadata = prefetcher.get(index)
+            with profiler.phase('video', job.name):
+                download_course(metadata.m3u8_url, job.cid, job.term_id, job.filepath,
+                                resolved=(metadata.key, metadata.ts_urls, metadata.ivs))
+        except Exception as e:
+            logger.exception(f"{job.name} 下载失败")
+            return DownloadResult(job, time.time() - start, e)
+        return DownloadResult(job, time.time() - start)
+
+    def run(self, jobs):
+        """
+        下载所有任务,按任务顺序输出完成情况
+        @param jobs: 下载任务列表
+        @return: 下载结果列表,与任务顺序一致
+        """
+        results = []
+        planner = QualityPlanner(len(jobs))
+        prefetcher = MetadataPrefetcher(jobs, planner=planner if planner.enabled else None)
+        with ThreadPoolExecutor(max_workers=self.video_workers) as executor:
+            futures = [executor.submit(self.download, job, prefetcher, i) for i, job in enumerate(jobs)]
+            for i, future in enumerate(futures):
+                result = future.result()
+                results.append(result)
+                self.report(i, len(jobs), result)
+        prefetcher.close()
+        self.summary(results)
+        # 输出剩余的信息后再回到菜单
+        progress_renderer.stop()
+        return results
+
+    @staticmethod
+    def report(index, total, result: DownloadResult):
+        """输出单个视频的完成情况"""
+        status = "完成" if result.ok else f"失败({result.error})"
+        progress_renderer.message(f"[{index + 1}/{total}] {result.job.filepath} {status} 耗时 {result.time_cost:.1f}s")
+
+    @staticmethod
+    def summary(results):
+        """输出所有视频的完成情况"""
+        failed = [result for result in results if not result.ok]
+        progress_renderer.message('=' * 50)
+        progress_renderer.message(f"共 {len(results)} 个视频,成功 {len(results) - len(failed)} 个,失败 {len(failed)} 个")
+        for result in failed:
+            progress_renderer.message(f"  {result.job.filepath}: {result.error}")
@@ -15,3 +15,63 @@ DOMAIN = "ke.qq.com"
 DEFAULT_HEADERS = {'referer': 'https://ke.qq.com/webcourse/'}
 CURRENT_USER = {}
 PROXIES = getproxies()  # 避免当你使用魔法时出现 check_hostname requires server_hostname
+
+DOWNLOAD_WORKERS = 8  # 同时下载的 ts 文件数量
+
+HTTP_TIMEOUT = (5, 20)  # (连接超时, 读取超时)
+HTTP_RETRIES = 3  # 连接失败或服务器错误时的重试次数
+HTTP_POOL_SIZE = 16  # 每个 host 的连接池大小,不小于 DOWNLOAD_WORKERS
+HTTP_HOST_POOL_SIZES = {
+    # 接口请求量小,不需要太多连接
+    f"https://{DOMAIN}/": 4,
+}
+RANGE_CONNECTIONS = 4  # 单个视频文件分段下载的连接数
+# 下载方式
+#   split: 下载 ts 碎片文件再合成,支持断点续传
+#   stream: 按顺序直接写入一个 ts 文件,支持断点续传,保存为 .ts 文件
+#   pipe: 按顺序直接交给 ffmpeg 合成,不产生临时文件
+#   assemble: 乱序下载并直接写入一个 ts 文件中各自的位置(需要 ts 链接中有 start,end 参数),支持断点续传,保存为 .ts 文件
+DOWNLOAD_MODE = 'split'
+VIDEO_WORKERS = 3  # 同时下载的视频数量
+MAX_SEGMENT_REQUESTS = 16  # 所有视频同时进行的 ts 请求数量上限
+
+# 接口缓存时间(秒),不在其中的接口不缓存
+CACHE_TTL = {
+    'course': 24 * 3600,  # 课程信息
+    'courses': 3600,  # 课程列表
+    'rec_video_info': 3600,  # 视频信息,同时受视频链接签名过期时间限制
+}
+CACHE_MAX_AGE = 7 * 24 * 3600  # 缓存文件最长保存时间(秒)
+CACHE_MAX_SIZE = 64 * 1024 * 1024  # 缓存目录大小上限(字节)
+URL_EXPIRE_MARGIN = 600  # 签名链接在过期前多少秒视为不可用,预留下载时间
+KEY_TTL = 3600  # 秘钥缓存时间(秒)
+CHECKPOINT_SAVE_INTERVAL = 1  # 断点记录最多每隔多少秒写入一次文件,结束或出错时总会写入
+METADATA_LOOKAHEAD = 3  # 下载的同时提前解析元数据的视频数量
+DECRYPT_WORKERS = None  # 解密线程数,为空时使用 CPU 核心数
+DECRYPT_CHUNK_SIZE = 1024 * 1024  # 大文件分块解密时每块的大小,必须是 16 的倍数
+DECRYPT_WINDOW = 16  # 单个视频同时解密的 ts 文件数上限
+PLAYLIST_TTL = 600  # 解析后的 m3u8 播放列表缓存时间(秒)
+MAX_BANDWIDTH = None  # 主播放列表选择清晰度时的码率上限(bit/s),为空时选择最高码率
+# 按预算选择清晰度,都为空时总是下载最高清晰度
+QUALITY_BUDGET_SECONDS = None  # 所有视频的下载时间预算(秒)
+QUALITY_BUDGET_BYTES = None  # 所有视频的下载流量预算(字节)
+
+MAX_BYTES_PER_SECOND = None  # 所有下载的总带宽上限(字节/秒),为空时不限制
+# 每个 host 的同时连接数及每秒请求数上限,为空时不限制
+HOST_LIMITS = {
+    DOMAIN: {'connections': 4, 'rps': 10},
+}
+DEFAULT_HOST_LIMIT = {'connections': 16, 'rps': None}  # 没有单独设置的 host(如视频 CDN)
+SEGMENT_RETRIES = 3  # ts 请求失败或超时后的重试次数
+SEGMENT_TIMEOUT = (5, 60)  # 单个 ts 请求的总时限范围(秒),在范围内按观测到的 p99 延迟调整
+HEDGE_PERCENTILE = 0.95  # ts 请求超过该分位延迟仍未完成时,发起一个重复请求
+RETRY_BACKOFF = (0.5, 8)  # 重试等待时间的 (基数, 上限),每次翻倍并随机抖动
+PROGRESS_INTERVAL = 200  # 进度条刷新间隔(毫秒)
+PROGRESS_QUIET_INTERVAL = 5  # 输出不是终端时,以 json 行输出进度的间隔(秒)
+LOG_LEVEL = 'WARNING'  # 日志级别
+LOG_FILE = None  # 日志文件,为空时输出到标准错误
+# 运行指标导出文件,以 .json 结尾时导出 json,否则导出 Prometheus 文本格式;为空时不导出
+METRICS_PATH = None
+METRICS_INTERVAL = 30  # 运行中导出指标的间隔(秒),退出时还会再导出一次
+RECEIVE_READ_SIZE = (64 * 1024, 1024 * 1024)  # 接收数据时单次读取的 (初始, 最大) 字节数,连续读满时翻倍
+BUFFER_POOL_SIZE = 32  # 缓存复用的接收缓冲区数量上限
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class AccountHandler(BaseHTTPRequestHandler):
+    """返回默认账号信息"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({'retcode': 0, 'result': {'tiny_id': '123456'}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def setUpModule():
+    # settings 会在当前目录创建目录,cookies.json 存在时不会读取浏览器
+    global workdir, cwd
+    cwd = os.getcwd()
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name)
+    Path('cookies.json').write_text('{}')
+    for name in list(os.environ):
+        if name.lower().endswith('_proxy'):
+            del os.environ[name]
+    sys.path.insert(0, str(ROOT))
+
+
+def tearDownModule():
+    os.chdir(cwd)
+    workdir.cleanup()
+
+
+class AsyncApisTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), AccountHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/account"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_uin(self):
+        import async_apis
+        import urls
+
+        async def run():
+            try:
+                return await asyncio.wait_for(async_apis.get_uin(), timeout=10)
+            finally:
+                await async_apis.close_client()
+
+        with mock.patch.object(urls, 'DefaultAccount', self.url):
+            self.assertEqual(asyncio.run(run()), '123456')
+
+
+if __name__ == '__main__':
+    unittest.main()
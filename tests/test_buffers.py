@@ -0,0 +1,74 @@
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from buffers import buffer_pool, receive  # noqa: E402
+
+BODY = os.urandom(65536)
+
+
+class SegmentHandler(BaseHTTPRequestHandler):
+    """/length 带 Content-Length 返回,/chunked 使用分块编码返回"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        if self.path == '/chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for offset in range(0, len(BODY), 10000):
+                chunk = BODY[offset:offset + 10000]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+
+class ReceiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SegmentHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.session = requests.Session()
+        self.session.trust_env = False
+        buffer_pool.buffers.clear()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self, path, size_hint=None):
+        with self.session.get(self.url + path, stream=True) as response:
+            return receive(response, size_hint)
+
+    def test_exact_content_length_is_not_reallocated(self):
+        content = self.fetch('/length')
+        self.assertEqual(bytes(content), BODY)
+        self.assertEqual(len(content.obj), len(BODY))
+
+    def test_exact_size_hint_is_not_reallocated(self):
+        content = self.fetch('/chunked', size_hint=len(BODY))
+        self.assertEqual(bytes(content), BODY)
+        self.assertEqual(len(content.obj), len(BODY))
+
+    def test_grows_past_small_hint(self):
+        content = self.fetch('/chunked', size_hint=1000)
+        self.assertEqual(bytes(content), BODY)
+
+
+if __name__ == '__main__':
+    unittest.main()
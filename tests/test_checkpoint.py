@@ -0,0 +1,52 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from checkpoint import Checkpoint, BitmapCheckpoint, playlist_fingerprint  # noqa: E402
+
+TS_URLS = [f"https://cdn.example.com/720p/video.ts?start={i * 100}&end={i * 100 + 99}&sign=a" for i in range(3)]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.workdir.name, 'checkpoint.json')
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_fingerprint_ignores_signature_only(self):
+        resigned = [url.replace('sign=a', 'sign=b') for url in TS_URLS]
+        other_quality = [url.replace('720p', '1080p') for url in TS_URLS]
+        self.assertEqual(playlist_fingerprint(TS_URLS), playlist_fingerprint(resigned))
+        self.assertNotEqual(playlist_fingerprint(TS_URLS), playlist_fingerprint(other_quality))
+        self.assertNotEqual(playlist_fingerprint(TS_URLS), playlist_fingerprint(TS_URLS[:2]))
+
+    def test_other_playlist_discards_segments(self):
+        checkpoint = Checkpoint(self.path, b'k' * 16, playlist_fingerprint(TS_URLS))
+        checkpoint.done(0, 100)
+        checkpoint.flush()
+        self.assertTrue(Checkpoint(self.path, b'k' * 16, playlist_fingerprint(TS_URLS)).is_done(0))
+        other = [url.replace('720p', '1080p') for url in TS_URLS]
+        self.assertFalse(Checkpoint(self.path, b'k' * 16, playlist_fingerprint(other)).is_done(0))
+
+    def test_saves_are_throttled_until_flush(self):
+        for load in (lambda **kwargs: Checkpoint(self.path, 'key', **kwargs),
+                     lambda **kwargs: BitmapCheckpoint(self.path, 'key', 3, **kwargs)):
+            self.path.unlink(missing_ok=True)
+            checkpoint = load(save_interval=3600)
+            checkpoint.done(0, 100)
+            self.assertTrue(self.path.exists())
+            for i in range(1, 3):
+                checkpoint.done(i, 100)
+            self.assertFalse(load().is_done(2))
+            checkpoint.flush()
+            self.assertTrue(load().is_done(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
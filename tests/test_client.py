@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class BodyHandler(BaseHTTPRequestHandler):
+    """返回固定内容"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = b'0' * 1024
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def setUpModule():
+    # settings 会在当前目录创建目录,cookies.json 存在时不会读取浏览器
+    global workdir, cwd
+    cwd = os.getcwd()
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name)
+    Path('cookies.json').write_text('{}')
+    for name in list(os.environ):
+        if name.lower().endswith('_proxy'):
+            del os.environ[name]
+    sys.path.insert(0, str(ROOT))
+
+
+def tearDownModule():
+    os.chdir(cwd)
+    workdir.cleanup()
+
+
+class ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), BodyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_stream_holds_host_slot_until_closed(self):
+        import client as client_module
+        from governor import Governor
+
+        governor = Governor(default_host_limit={'connections': 1, 'rps': None})
+        semaphore = governor.get_semaphore('127.0.0.1')
+        with mock.patch.object(client_module, 'governor', governor):
+            client = client_module.Client()
+            self.assertEqual(len(client.get(self.url).content), 1024)
+            self.assertTrue(semaphore.acquire(blocking=False))
+            semaphore.release()
+
+            response = client.get(self.url, stream=True)
+            self.assertFalse(semaphore.acquire(blocking=False))
+            with response:
+                self.assertEqual(len(response.content), 1024)
+            self.assertTrue(semaphore.acquire(blocking=False))
+            semaphore.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import io
+import os
+import sys
+import unittest
+from pathlib import Path
+
+from Crypto.Cipher import AES
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from decrypt_pool import DecryptPool  # noqa: E402
+
+
+class DecryptStreamTest(unittest.TestCase):
+
+    def test_chunks_use_ciphertext_iv(self):
+        # 频繁切换线程,让解密线程尽可能先于读取下一块初始向量执行
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+
+        pool = DecryptPool(4)
+        key, iv = os.urandom(16), os.urandom(16)
+        plain = os.urandom(4096 * 8 + 48)
+        ciphertext = iv + AES.new(key, AES.MODE_CBC, iv).encrypt(plain)
+        for _ in range(50):
+            chunks = pool.decrypt_stream(io.BytesIO(ciphertext), key, chunk_size=4096)
+            self.assertEqual(b''.join(bytes(chunk) for chunk in chunks), plain)
+
+
+if __name__ == '__main__':
+    unittest.main()
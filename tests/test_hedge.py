@@ -0,0 +1,61 @@
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Semaphore
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from hedge import Hedger, HedgeCancelled  # noqa: E402
+
+
+class HedgerTest(unittest.TestCase):
+
+    def test_queueing_is_not_measured(self):
+        hedger = Hedger(retries=0, workers=8)
+        semaphore = Semaphore(1)
+
+        def request(timeout):
+            with semaphore, hedger.measure():
+                time.sleep(0.05)
+            return timeout
+
+        with ThreadPoolExecutor(4) as executor:
+            for _ in range(5):
+                list(executor.map(lambda _: hedger.call(request), range(4)))
+        # 四个请求排队使用一个名额,计入排队时间的话样本会达到 0.2 秒
+        self.assertEqual(len(hedger.tracker.samples), 20)
+        self.assertLess(max(hedger.tracker.samples), 0.12)
+        self.assertEqual(hedger.hedges, 0)
+
+    def test_loser_is_cancelled(self):
+        hedger = Hedger(retries=0, workers=8)
+        for _ in range(hedger.tracker.min_samples):
+            hedger.tracker.add(0.01)
+        calls = []
+        cancelled = []
+        discarded = []
+
+        def request(name, timeout):
+            calls.append(name)
+            with hedger.measure():
+                # 第一次请求很慢,对冲请求先完成
+                for _ in range(100 if len(calls) == 1 else 1):
+                    time.sleep(0.01)
+                    if hedger.cancelled():
+                        cancelled.append(name)
+                        raise HedgeCancelled(name)
+            return len(calls)
+
+        self.assertEqual(hedger.call(request, 'ts', discard=discarded.append), 2)
+        self.assertEqual(hedger.hedges, 1)
+        deadline = time.monotonic() + 1
+        while not cancelled and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cancelled, ['ts'])
+        self.assertEqual(discarded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
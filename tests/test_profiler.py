@@ -0,0 +1,33 @@
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from profiler import Profiler  # noqa: E402
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_nested_and_bound_phases_use_video_name(self):
+        profiler = Profiler()
+        profiler.start()
+
+        def task():
+            with profiler.phase('decrypt'):
+                pass
+
+        with ThreadPoolExecutor(2) as executor:
+            with profiler.phase('video', 'a.mp4'):
+                with profiler.phase('segment'):
+                    pass
+                executor.submit(profiler.bind(task)).result()
+            executor.submit(profiler.bind(task)).result()
+
+        videos = [(event['name'], event['args'].get('video')) for event in profiler.events]
+        self.assertEqual(videos, [('segment', 'a.mp4'), ('decrypt', 'a.mp4'), ('video', 'a.mp4'), ('decrypt', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from quality import QualityPlanner, ThroughputMeter  # noqa: E402
+
+
+def video_info(*sizes):
+    return {'infos': [{'url': f"https://example.com/{i}.m3u8", 'size': size} for i, size in enumerate(sizes)]}
+
+
+class QualityPlannerTest(unittest.TestCase):
+
+    def test_missing_size_fails(self):
+        planner = QualityPlanner(1, budget_bytes=100, meter=ThroughputMeter())
+        with self.assertRaises(ValueError):
+            planner.choose({'infos': [{'url': 'https://example.com/0.m3u8'}]})
+
+    def test_plans_without_speed_sample(self):
+        # 只有时间预算且还没有测到速度时选择最高清晰度,但仍计入已选择的大小
+        planner = QualityPlanner(3, budget_seconds=60, meter=ThroughputMeter())
+        self.assertEqual(planner.choose(video_info(300, 100)), 0)
+        self.assertEqual(planner.choose(video_info(300, 100)), 0)
+        self.assertEqual(planner.planned_bytes, 600)
+
+    def test_byte_budget(self):
+        planner = QualityPlanner(2, budget_bytes=500, meter=ThroughputMeter())
+        self.assertEqual(planner.choose(video_info(300, 200)), 1)
+        self.assertEqual(planner.choose(video_info(300, 200)), 0)
+        self.assertEqual(planner.planned_bytes, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
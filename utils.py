@@ -4,6 +4,7 @@ import sys
 import time
 from pathlib import Path
 from typing import Tuple
+from urllib.parse import parse_qs, urlparse
 
 
 def run_shell(shell, retry=True, retry_times=3):
@@ -83,3 +84,35 @@ def size_format(size: int, *, pro: int = 1.0, dec: int = 2):
         if pos >= len(unit):
             break
     return str(round(size, dec)) + unit[pos]
+
+
+def get_url_expire(url: str):
+    """
+    获取签名链接的过期时间
+    腾讯云点播的防盗链链接中 t 参数为十六进制的过期时间戳
+    @param url: 链接
+    @return: 过期时间戳,链接没有签名时返回 None
+    """
+    if not url:
+        return None
+    t = parse_qs(urlparse(url).query).get('t')
+    if not t:
+        return None
+    try:
+        return int(t[0], 16)
+    except ValueError:
+        return None
+
+
+def get_ts_range(url: str):
+    """
+    获取 ts 链接中的字节范围
+    腾讯课堂的 ts 链接中 start,end 参数为分段在整个视频中的起止位置(包含 end)
+    @param url: ts 链接
+    @return: (start, end),链接中没有时返回 None
+    """
+    query = parse_qs(urlparse(url).query)
+    try:
+        return int(query['start'][0]), int(query['end'][0])
+    except (KeyError, ValueError):
+        return None